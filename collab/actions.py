@@ -0,0 +1,98 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+class ActionQueue(object):
+    """
+    Writes activity stream actions on a background thread.
+
+    Actions are queued once the surrounding transaction has been committed and
+    written with bulk INSERTs of up to COLLAB_DEFERRED_ACTIONS_BATCH_SIZE rows,
+    so request threads and bulk imports don't wait for them.
+
+    Unlike actstream's action.send, no action signal is sent; receivers
+    hooked into actstream's handler won't see deferred actions. A batch that
+    fails to be written is logged and dropped.
+    """
+
+    def __init__(self):
+        self._pending = []
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def batch_size(self):
+        return getattr(settings, "COLLAB_DEFERRED_ACTIONS_BATCH_SIZE", 500)
+
+    def build_action(self, actor, verb, action_object=None, target=None,
+            **kwargs):
+        """
+        Returns an unsaved actstream Action.
+        """
+        from actstream.models import Action
+        action = Action(
+            actor_content_type=ContentType.objects.get_for_model(actor),
+            actor_object_id=str(actor.pk),
+            verb=str(verb),
+            **kwargs
+        )
+        if action_object is not None:
+            action.action_object_content_type = \
+                ContentType.objects.get_for_model(action_object)
+            action.action_object_object_id = str(action_object.pk)
+        if target is not None:
+            action.target_content_type = ContentType.objects.get_for_model(target)
+            action.target_object_id = str(target.pk)
+        return action
+
+    def enqueue(self, actor, verb, **kwargs):
+        """
+        Queue an action to be written after the current transaction commits.
+        """
+        action = self.build_action(actor, verb, **kwargs)
+        transaction.on_commit(lambda: self.add(action))
+
+    def add(self, action):
+        """
+        Queue an unsaved action and schedule a flush unless one is pending.
+        """
+        with self._lock:
+            self._pending.append(action)
+            needs_flush = len(self._pending) == 1
+        if needs_flush:
+            self.schedule_flush()
+
+    def schedule_flush(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1)
+        self._executor.submit(self._flush_in_thread)
+
+    def _flush_in_thread(self):
+        try:
+            self.flush()
+        except Exception:
+            # nobody reads the executor's futures
+            logger.exception("Writing deferred activity stream actions failed")
+        finally:
+            connections.close_all()
+
+    def flush(self):
+        """
+        Write all queued actions. Returns the number of written actions.
+        """
+        from actstream.models import Action
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if pending:
+            Action.objects.bulk_create(pending, batch_size=self.batch_size)
+        return len(pending)
+
+
+action_queue = ActionQueue()
@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from .models import Collab
+
+logger = logging.getLogger(__name__)
+
+
+class LastActivityBuffer(object):
+    """
+    Write-behind buffer for Collab.last_activity.
+
+    Instead of issuing an UPDATE per request, timestamps are collected in
+    memory per user and written with a single UPDATE once
+    COLLAB_LAST_ACTIVITY_FLUSH_INTERVAL seconds have passed or
+    COLLAB_LAST_ACTIVITY_BATCH_SIZE users are pending, whichever comes first.
+    With background=True, that UPDATE runs on a background thread instead of
+    the thread recording the activity.
+
+    Timestamps still pending when the process exits are lost. That is
+    acceptable for a "last seen" value which is refreshed on the next request.
+    """
+
+    def __init__(self, flush_interval=None, batch_size=None, background=False):
+        self._flush_interval = flush_interval
+        self._batch_size = batch_size
+        self._background = background
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._executor = None
+
+    @property
+    def flush_interval(self):
+        if self._flush_interval is not None:
+            return self._flush_interval
+        return getattr(settings, "COLLAB_LAST_ACTIVITY_FLUSH_INTERVAL", 60) # seconds
+
+    @property
+    def batch_size(self):
+        if self._batch_size is not None:
+            return self._batch_size
+        return getattr(settings, "COLLAB_LAST_ACTIVITY_BATCH_SIZE", 500)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def touch(self, collab, now=None):
+        """
+        Record that the owner of the given Collab instance has just been seen.
+        Flushes the buffer if it is due.
+        """
+        now = now or timezone.now()
+        if not collab.last_activity_is_due(now):
+            return
+        # keep the in-memory instance consistent with what will be written
+        collab.last_activity = now
+        self.touch_user(collab.user_id, now)
+
+    def touch_user(self, user_pk, now=None):
+        """
+        Record that the user with the given pk has just been seen, without
+        throttling. Flushes the buffer if it is due.
+        """
+        now = now or timezone.now()
+        with self._lock:
+            self._pending[user_pk] = now
+            is_due = len(self._pending) >= self.batch_size or \
+                time.monotonic() - self._last_flush >= self.flush_interval
+            if is_due:
+                # don't schedule again until the flush has started
+                self._last_flush = time.monotonic()
+        if not is_due:
+            return
+        if self._background:
+            self.schedule_flush()
+        else:
+            self.flush()
+
+    def schedule_flush(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1)
+        self._executor.submit(self._flush_in_thread)
+
+    def _flush_in_thread(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Writing Collab.last_activity failed")
+        finally:
+            connections.close_all()
+
+    def flush(self):
+        """
+        Write all pending timestamps to the database. Returns the number of
+        updated Collab rows.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        items = list(pending.items())
+        updated = 0
+        for start in range(0, len(items), self.batch_size):
+            batch = items[start:start + self.batch_size]
+            updated += Collab.objects.filter(
+                user_id__in=[user_pk for user_pk, ts in batch]
+            ).update(last_activity=Case(
+                *[When(user_id=user_pk, then=Value(ts)) for user_pk, ts in batch],
+                output_field=DateTimeField()
+            ))
+        return updated
+
+
+last_activity_buffer = LastActivityBuffer()
@@ -10,4 +10,7 @@ class DjangoCollabConfig(AppConfig):
         # activate activity streams for Spaces
         from actstream import registry
         from spaces.models import Space
-        registry.register(Space)
\ No newline at end of file
+        registry.register(Space)
+        # link Spaces in activity streams to their dashboards
+        from .util import register_action_url
+        register_action_url(Space, lambda space: '/%s/' % space.slug)
\ No newline at end of file
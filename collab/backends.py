@@ -0,0 +1,24 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+
+class CollabModelBackend(ModelBackend):
+    """
+    Drop-in replacement for django.contrib.auth.backends.ModelBackend which
+    loads the Collab extension in the same query as the session user, saving
+    one query on every authenticated request.
+
+    Users without a Collab row are loaded as well. Accessing user.collab on
+    them raises RelatedObjectDoesNotExist without another query; use
+    collab.util.get_collab() where that can happen.
+    """
+
+    def get_user(self, user_id):
+        UserModel = get_user_model()
+        try:
+            user = UserModel._default_manager.select_related('collab').get(
+                pk=user_id
+            )
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
@@ -1,13 +1,31 @@
 from spaces.models import SpacePluginRegistry
 
+_space_plugins = None
+
+
+def get_space_plugins():
+    """
+    Returns the registered space plugins as a tuple. The registry is only
+    filled at startup, so the result is computed once and reused.
+    """
+    global _space_plugins
+    if _space_plugins is None:
+        _space_plugins = tuple(SpacePluginRegistry.get_plugins())
+    return _space_plugins
+
+def reset_space_plugins():
+    """
+    Forget the cached space plugins, e.g. in tests or after registering a
+    plugin at runtime.
+    """
+    global _space_plugins
+    _space_plugins = None
 
 def default(request):
     """
         Fill in commonly needed context for space-based theming etc.
     """
     context = {}
-    # get_plugins() is a generator. Converting to list so we can use the output
-    # multiple times.
-    context["space_plugins"] = list(SpacePluginRegistry.get_plugins())
+    context["space_plugins"] = get_space_plugins()
     context["space"] = request.SPACE if hasattr(request,'SPACE') else None
     return context
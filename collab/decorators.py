@@ -1,11 +1,22 @@
+import asyncio
+from urllib.parse import urlparse
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth import REDIRECT_FIELD_NAME
 from django.contrib.auth.decorators import user_passes_test
+from django.contrib.auth.views import redirect_to_login
 from django.core.exceptions import PermissionDenied
+from django.http import HttpResponseForbidden
+from django.shortcuts import render, resolve_url
 from django.utils.functional import wraps
+from guardian.conf import settings as guardian_settings
 from guardian.exceptions import GuardianError
 from guardian.utils import get_40x_or_None
-from .util import is_manager, is_space_admin_or_manager
+from . import rules
+from .instrumentation import instrument
+from .resolver import get_resolver
+from .util import is_manager
 
 def manager_required(func=None):
     """
@@ -16,12 +27,54 @@ def manager_required(func=None):
     @manager_required
     def my_function():
         [...]
+
+    Works with async views, too. The check then runs in a single
+    sync_to_async call, as auth and guardian are sync only.
     """
-    decorator = user_passes_test(is_manager)
+    check = instrument('manager_required')(is_manager)
+
+    def decorator(view_func):
+        if not asyncio.iscoroutinefunction(view_func):
+            return user_passes_test(check)(view_func)
+        async def _wrapped_view(request, *args, **kwargs):
+            if await sync_to_async(check)(request.user):
+                return await view_func(request, *args, **kwargs)
+            return _redirect_to_login(request)
+        return wraps(view_func)(_wrapped_view)
+
     if func:
         return decorator(func)
     return decorator
 
+def _redirect_to_login(request, login_url=None,
+        redirect_field_name=REDIRECT_FIELD_NAME):
+    """
+    Same redirect as the one of django's user_passes_test.
+    """
+    path = request.build_absolute_uri()
+    resolved_login_url = resolve_url(login_url or settings.LOGIN_URL)
+    login_scheme, login_netloc = urlparse(resolved_login_url)[:2]
+    current_scheme, current_netloc = urlparse(path)[:2]
+    if ((not login_scheme or login_scheme == current_scheme) and
+            (not login_netloc or login_netloc == current_netloc)):
+        path = request.get_full_path()
+    return redirect_to_login(path, resolved_login_url, redirect_field_name)
+
+def _get_denied_response(request, return_403, login_url, redirect_field_name):
+    """
+    Same response as guardian's get_40x_or_None for a denied permission.
+    """
+    if return_403:
+        if guardian_settings.RENDER_403:
+            response = render(request, guardian_settings.TEMPLATE_403)
+            response.status_code = 403
+            return response
+        elif guardian_settings.RAISE_403:
+            raise PermissionDenied
+        return HttpResponseForbidden()
+    return redirect_to_login(request.get_full_path(), login_url,
+        redirect_field_name)
+
 def space_admin_required(func):
     """
     method decorator raising 403 if user is not a space administrator in the
@@ -29,19 +82,27 @@ def space_admin_required(func):
     Mostly identical to the same function from django-spaces, but this one uses
     is_owner_or_admin and respects superuser privileges
     """
+    if asyncio.iscoroutinefunction(func):
+        async def _decorator(self, *args, **kwargs):
+            if await sync_to_async(_is_space_admin_allowed)(self):
+                return await func(self, *args, **kwargs)
+            raise PermissionDenied
+        return _decorator
     def _decorator(self, *args, **kwargs):
-        if self.user and self.user.is_authenticated:
-            is_allowed = self.user.is_superuser
-            if not is_allowed:
-                is_allowed = is_space_admin_or_manager(
-                    self.user, 
-                    self.SPACE
-                )
-            if is_allowed:
-                return func(self, *args, **kwargs)
+        if _is_space_admin_allowed(self):
+            return func(self, *args, **kwargs)
         raise PermissionDenied
     return _decorator
 
+@instrument('space_admin_required')
+def _is_space_admin_allowed(request):
+    if request.user and request.user.is_authenticated:
+        resolver = get_resolver(request)
+        if resolver.is_superuser:
+            return True
+        return resolver.is_space_admin_or_manager(request.SPACE)
+    return False
+
 def permission_required(perm, **kwargs):
     """
     Decorator for views that checks whether a user has a particular permission
@@ -69,17 +130,21 @@ def permission_required(perm, **kwargs):
             return HttpResponse('Hello')
 
     This decorator is heavily based on the ones from django-spaces.
-    The difference: if user has the manager role, always return True on certain
-    permissions.
+    The difference: before asking guardian, the short-circuit rules from
+    collab.rules are evaluated. By default anonymous users are sent to the
+    login page, superusers are granted everything and managers are granted
+    the permissions in COLLAB_MANAGER_PERMS (default: 'access_space').
 
     This is a bit hacky, but right now a custom permission backend would be
     overkill.
+
+    Coroutine views are wrapped in an async view, which runs the check in a
+    single sync_to_async call.
     """
     login_url = kwargs.pop('login_url', settings.LOGIN_URL)
     redirect_field_name = kwargs.pop('redirect_field_name', REDIRECT_FIELD_NAME)
     return_403 = kwargs.pop('return_403', False)
     accept_global_perms = kwargs.pop('accept_global_perms', False)
-    manager_perms = ['access_space',]
 
     # Check if perm is given as string in order not to decorate
     # view function itself which makes debugging harder
@@ -87,29 +152,45 @@ def permission_required(perm, **kwargs):
         raise GuardianError("First argument must be in format: "
             "'app_label.codename or a callable which return similar string'")
 
+    @instrument('permission_required', is_allowed=lambda response: response is None)
+    def check_permission(request):
+        """
+        Returns None if access is granted, else the response to return.
+        """
+        # enforce redirect to login for anonymous users for better user
+        # experience
+        ret_403 = False if not request.user.is_authenticated else return_403
+        obj = request.SPACE
+
+        # cheap rules first, see collab.rules
+        decision = rules.evaluate(request, perm, obj)
+        if decision is True:
+            return None
+        if decision is False:
+            return _get_denied_response(request, ret_403, login_url,
+                redirect_field_name)
+
+        # the memoized check lets stacked decorators share one lookup.
+        # On denial guardian builds the appropriate response.
+        if get_resolver(request).has_perm(perm, obj, accept_global_perms):
+            return None
+        return get_40x_or_None(request, perms=[perm], obj=obj,
+            login_url=login_url, redirect_field_name=redirect_field_name,
+            return_403=ret_403, accept_global_perms=accept_global_perms)
+
     def decorator(view_func):
-        def _wrapped_view(request, *args, **kwargs):
-            if hasattr(request.user, "collab") and \
-                request.user.collab.is_manager and perm in manager_perms:
+        if asyncio.iscoroutinefunction(view_func):
+            async def _wrapped_view(request, *args, **kwargs):
+                response = await sync_to_async(check_permission)(request)
+                if response:
+                    return response
+                return await view_func(request, *args, **kwargs)
+        else:
+            def _wrapped_view(request, *args, **kwargs):
+                response = check_permission(request)
+                if response:
+                    return response
                 return view_func(request, *args, **kwargs)
-
-            #if not request.user.is_authenticated:
-            #    do_403 = False # enforce redirect to login for better user
-            #                       # experience
-            #else:
-            #    do_403
-            ret_403 = False if not request.user.is_authenticated else return_403
-
-            # if more than one parameter is passed to the decorator we try to
-            # fetch object for which check would be made
-            obj = request.SPACE
-
-            response = get_40x_or_None(request, perms=[perm], obj=obj,
-                login_url=login_url, redirect_field_name=redirect_field_name,
-                return_403=ret_403, accept_global_perms=accept_global_perms)
-            if response:
-                return response
-            return view_func(request, *args, **kwargs)
         return wraps(view_func)(_wrapped_view)
     return decorator
 
@@ -0,0 +1,80 @@
+"""
+Keyset-paginated activity feed of a space.
+
+Actions are ordered by (timestamp, id), newest first. A page is selected by
+the cursor of the last action of the previous page instead of an offset, so
+deep pages cost as much as the first one. Actors and action objects are
+prefetched in one query per content type.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q
+from django.utils import timezone
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+FeedPage = namedtuple('FeedPage', ['actions', 'next_cursor'])
+
+
+def encode_cursor(action):
+    """
+    Returns the cursor of the given action, '<microseconds>-<id>'.
+    """
+    timestamp = action.timestamp
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp, dt_timezone.utc)
+    delta = timestamp - EPOCH
+    microseconds = (delta.days * 86400 + delta.seconds) * 10**6 + delta.microseconds
+    return '%d-%d' % (microseconds, action.pk)
+
+def decode_cursor(cursor):
+    """
+    Returns (timestamp, id) of the given cursor. Raises ValueError for
+    malformed cursors.
+    """
+    microseconds, pk = cursor.split('-')
+    pk = int(pk)
+    # older Django versions pass out-of-range integers on to the database
+    if not 0 < pk < 2**63:
+        raise ValueError("Cursor out of range: %r" % cursor)
+    try:
+        timestamp = EPOCH + timedelta(microseconds=int(microseconds))
+    except OverflowError:
+        raise ValueError("Cursor out of range: %r" % cursor)
+    if not settings.USE_TZ:
+        timestamp = timezone.make_naive(timestamp, dt_timezone.utc)
+    return timestamp, pk
+
+def space_actions(space, cursor=None, limit=None):
+    """
+    Returns a FeedPage with the public actions targeting space, starting
+    after cursor. next_cursor is None on the last page.
+    """
+    from actstream.models import Action
+    if limit is None:
+        limit = getattr(settings, "COLLAB_FEED_PAGE_SIZE", 20)
+    queryset = Action.objects.filter(
+        target_content_type=ContentType.objects.get_for_model(space),
+        target_object_id=str(space.pk),
+        public=True,
+    )
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, pk__lt=pk)
+        )
+    actions = list(
+        queryset.order_by('-timestamp', '-pk')
+        .prefetch_related('actor', 'action_object')[:limit + 1]
+    )
+    next_cursor = None
+    if len(actions) > limit:
+        actions = actions[:limit]
+        next_cursor = encode_cursor(actions[-1])
+    for action in actions:
+        # all actions of the page target this space
+        Action.target.set_cached_value(action, space)
+    return FeedPage(actions, next_cursor)
@@ -0,0 +1,104 @@
+"""
+Cross-request index of space admin memberships, kept in Django's cache
+framework.
+
+Enable it by setting COLLAB_ADMIN_INDEX_CACHE to the alias of a cache shared
+by all processes, e.g. 'default'. Entries are invalidated by the signal
+receivers in collab.signals whenever group memberships or Spaces change.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+GENERATION_KEY = 'collab:admins:generation'
+
+
+def get_index_cache():
+    """
+    Returns the cache configured by COLLAB_ADMIN_INDEX_CACHE or None if the
+    index is disabled.
+    """
+    alias = getattr(settings, "COLLAB_ADMIN_INDEX_CACHE", None)
+    return caches[alias] if alias else None
+
+def _get_timeout():
+    return getattr(settings, "COLLAB_ADMIN_INDEX_TIMEOUT", 3600) # seconds
+
+def _get_generation(cache):
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # start from a fresh value so that entries of an evicted generation
+        # can never become valid again.
+        cache.add(GENERATION_KEY, int(time.time() * 1000), None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+def _get_space_key(generation, space_pk):
+    return 'collab:admins:%s:%s' % (generation, space_pk)
+
+def load_space_admin_ids(space):
+    """
+    Returns the pks of all admins of the given space, straight from the
+    database.
+    """
+    return frozenset(
+        space.get_admins().user_set.values_list('pk', flat=True)
+    )
+
+def space_admin_ids(space):
+    """
+    Returns a frozenset with the pks of all admins of the given space, served
+    from the index if it is enabled.
+    """
+    cache = get_index_cache()
+    if cache is None:
+        return load_space_admin_ids(space)
+    key = _get_space_key(_get_generation(cache), space.pk)
+    admin_ids = cache.get(key)
+    if admin_ids is None:
+        admin_ids = load_space_admin_ids(space)
+        cache.set(key, admin_ids, _get_timeout())
+    return admin_ids
+
+def space_admin_ids_many(spaces):
+    """
+    Returns a dict mapping the pk of each given space to the frozenset of its
+    admin pks. Cached entries are fetched in a single round trip.
+    """
+    cache = get_index_cache()
+    if cache is None:
+        return dict((space.pk, load_space_admin_ids(space)) for space in spaces)
+    generation = _get_generation(cache)
+    keys = dict((_get_space_key(generation, space.pk), space) for space in spaces)
+    cached = cache.get_many(list(keys))
+    result = {}
+    missing = {}
+    for key, space in keys.items():
+        if key in cached:
+            result[space.pk] = cached[key]
+        else:
+            result[space.pk] = missing[key] = load_space_admin_ids(space)
+    if missing:
+        cache.set_many(missing, _get_timeout())
+    return result
+
+def invalidate_space(space_pk):
+    """
+    Drops the index entry of a single space.
+    """
+    cache = get_index_cache()
+    if cache is not None:
+        cache.delete(_get_space_key(_get_generation(cache), space_pk))
+
+def invalidate_all():
+    """
+    Drops the index entries of all spaces by starting a new generation.
+    """
+    cache = get_index_cache()
+    if cache is None:
+        return
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        _get_generation(cache)
@@ -0,0 +1,153 @@
+"""
+Instrumentation of collab's permission checks.
+
+With COLLAB_PERMISSION_METRICS = True every instrumented check sends the
+permission_checked signal and is added to the metrics of the current
+request, see PermissionMetricsMiddleware. When disabled, the checks run
+without any overhead besides a settings lookup.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection
+from django.dispatch import Signal
+from django.utils.deprecation import MiddlewareMixin
+
+logger = logging.getLogger(__name__)
+
+# sent after every instrumented check with the arguments
+# check, allowed, duration (seconds) and queries.
+permission_checked = Signal()
+
+_local = threading.local()
+
+
+def metrics_enabled():
+    return getattr(settings, "COLLAB_PERMISSION_METRICS", False)
+
+
+class PermissionMetrics(object):
+    """
+    Permission check metrics aggregated over one request. Checks running
+    inside other checks are sent as signals, but only the outermost one is
+    aggregated, so that time and queries aren't counted twice.
+    """
+
+    def __init__(self):
+        self.checks = 0
+        self.denied = 0
+        self.duration = 0.0
+        self.queries = 0
+        self.by_check = {}
+
+    def add(self, check, allowed, duration, queries):
+        self.checks += 1
+        self.denied += 0 if allowed else 1
+        self.duration += duration
+        self.queries += queries
+        count, total_duration, total_queries = self.by_check.get(check, (0, 0.0, 0))
+        self.by_check[check] = (
+            count + 1, total_duration + duration, total_queries + queries
+        )
+
+    def __str__(self):
+        return "checks=%d; denied=%d; time=%.2fms; queries=%d" % (
+            self.checks, self.denied, self.duration * 1000, self.queries
+        )
+
+
+def get_current_metrics():
+    """
+    Returns the PermissionMetrics of the current request or None.
+    """
+    return getattr(_local, 'metrics', None)
+
+@contextmanager
+def collect_metrics():
+    """
+    Aggregates the metrics of all checks inside the block into the yielded
+    PermissionMetrics instance.
+    """
+    previous = get_current_metrics()
+    _local.metrics = metrics = PermissionMetrics()
+    try:
+        yield metrics
+    finally:
+        _local.metrics = previous
+
+
+class _QueryCounter(object):
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def instrument(check, is_allowed=bool):
+    """
+    Decorator recording duration, issued queries and outcome of a check
+    function under the name check. is_allowed maps the return value of the
+    function to the outcome. A PermissionDenied exception counts as denied.
+    """
+    def decorator(func):
+        @wraps(func)
+        def _wrapped(*args, **kwargs):
+            if not metrics_enabled():
+                return func(*args, **kwargs)
+            counter = _QueryCounter()
+            depth = getattr(_local, 'depth', 0)
+            _local.depth = depth + 1
+            allowed = False
+            start = time.perf_counter()
+            try:
+                with connection.execute_wrapper(counter):
+                    result = func(*args, **kwargs)
+                allowed = is_allowed(result)
+                return result
+            finally:
+                duration = time.perf_counter() - start
+                _local.depth = depth
+                metrics = get_current_metrics()
+                if depth == 0 and metrics is not None:
+                    metrics.add(check, allowed, duration, counter.count)
+                permission_checked.send(
+                    sender=func, check=check, allowed=allowed,
+                    duration=duration, queries=counter.count
+                )
+        return _wrapped
+    return decorator
+
+
+class PermissionMetricsMiddleware(MiddlewareMixin):
+    """
+    Aggregates the permission checks of each request. The totals are logged
+    to the 'collab.instrumentation' logger at DEBUG level and, with
+    COLLAB_PERMISSION_METRICS_HEADER = True, returned in the
+    X-Collab-Permissions response header.
+
+    Add it before any middleware performing permission checks.
+    """
+
+    def process_request(self, request):
+        if metrics_enabled():
+            request._collab_metrics_block = collect_metrics()
+            request.collab_metrics = request._collab_metrics_block.__enter__()
+
+    def process_response(self, request, response):
+        block = getattr(request, '_collab_metrics_block', None)
+        if block is None:
+            return response
+        block.__exit__(None, None, None)
+        del request._collab_metrics_block
+        metrics = request.collab_metrics
+        logger.debug("%s %s: %s", request.method, request.path, metrics)
+        if getattr(settings, "COLLAB_PERMISSION_METRICS_HEADER", False):
+            response['X-Collab-Permissions'] = str(metrics)
+        return response
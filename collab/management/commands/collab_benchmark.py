@@ -0,0 +1,39 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from ...benchmarks import Benchmark
+
+
+class Command(BaseCommand):
+    help = "Measures wall time and query count of collab's permission checks. " \
+        "All seeded data is rolled back."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200,
+            help="Number of users to create.")
+        parser.add_argument('--spaces', type=int, default=10,
+            help="Number of spaces to create.")
+        parser.add_argument('--admins', type=int, default=20,
+            help="Number of admins per space.")
+        parser.add_argument('--iterations', type=int, default=50,
+            help="Number of calls per check.")
+        parser.add_argument('--json', action='store_true',
+            help="Print the results as JSON, e.g. for comparing releases.")
+
+    def handle(self, *args, **options):
+        benchmark = Benchmark(
+            users=options['users'],
+            spaces=options['spaces'],
+            admins=options['admins'],
+            iterations=options['iterations'],
+        )
+        results = benchmark.run()
+        if options['json']:
+            self.stdout.write(json.dumps([r.as_dict() for r in results], indent=2))
+            return
+        self.stdout.write("%-40s %10s %12s" % ("check", "ms/call", "queries/call"))
+        for result in results:
+            self.stdout.write("%-40s %10.3f %12.1f" % (
+                result.name, result.ms_per_call, result.queries_per_call
+            ))
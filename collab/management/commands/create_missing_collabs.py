@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from ...provisioning import create_missing_collabs
+
+
+class Command(BaseCommand):
+    help = "Creates the Collab extension for all users that don't have one yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help="Number of users handled per INSERT statement."
+        )
+
+    def handle(self, *args, **options):
+        count = create_missing_collabs(batch_size=options['batch_size'])
+        self.stdout.write("Created Collab extensions for %d users." % count)
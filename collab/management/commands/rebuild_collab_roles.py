@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from ...models import SpaceRole
+from ...roles import rebuild_roles
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the denormalized role table used with COLLAB_ROLE_TABLE."
+
+    def handle(self, *args, **options):
+        rebuild_roles()
+        self.stdout.write("Rebuilt %d roles." % SpaceRole.objects.count())
@@ -1,10 +1,46 @@
-from django.utils.deprecation import MiddlewareMixin
+import asyncio
 
-class LastActivityMiddleware(MiddlewareMixin):
+from asgiref.sync import sync_to_async
+
+from .presence import get_presence_backend
+
+try:
+    from asgiref.sync import markcoroutinefunction
+except ImportError: # asgiref < 3.6
+    def markcoroutinefunction(func):
+        func._is_coroutine = asyncio.coroutines._is_coroutine
+        return func
+
+
+class LastActivityMiddleware(object):
     """
         Middleware to set timestamps when a user
-        has been last seen
+        has been last seen, using the presence backend configured by
+        COLLAB_PRESENCE_BACKEND. See collab.presence.
+
+        Supports both WSGI and ASGI. Under ASGI the user lookup and the
+        timestamp update run in a single sync_to_async call, and the rest
+        of the chain stays async.
     """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        self.process_request(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        await sync_to_async(self.process_request)(request)
+        return await self.get_response(request)
+
     def process_request(self, request):
         if request.user.is_authenticated:
-            request.user.collab.update_last_activity()
+            get_presence_backend().touch(request.user)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('auth', '__first__'),
+        ('spaces', '__first__'),
+        ('collab', '0003_collab_last_activity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpaceGroup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('admin', 'Space admin')], max_length=16)),
+                ('group', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='collab_space_group', to='auth.Group')),
+                ('space', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='collab_groups', to='spaces.Space')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SpaceRole',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('manager', 'Manager'), ('admin', 'Space admin')], max_length=16)),
+                ('space', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='collab_roles', to='spaces.Space')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='collab_roles', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='spacerole',
+            unique_together=set([('user', 'role', 'space')]),
+        ),
+        migrations.AddIndex(
+            model_name='spacerole',
+            index=models.Index(fields=['space', 'role'], name='collab_role_space_idx'),
+        ),
+    ]
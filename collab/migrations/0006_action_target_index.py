@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# Composite index for collab.feed: actions of one target, ordered by
+# (timestamp, id). actstream's Action belongs to another app, so the index is
+# created directly instead of through the model state.
+INDEX = models.Index(
+    fields=['target_content_type', 'target_object_id', 'timestamp', 'id'],
+    name='collab_action_target_idx',
+)
+
+
+def add_index(apps, schema_editor):
+    schema_editor.add_index(apps.get_model('actstream', 'Action'), INDEX)
+
+def remove_index(apps, schema_editor):
+    schema_editor.remove_index(apps.get_model('actstream', 'Action'), INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('actstream', '__first__'),
+        ('collab', '0005_collab_last_activity_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_index, remove_index),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def remove_duplicate_managers(apps, schema_editor):
+    SpaceRole = apps.get_model('collab', 'SpaceRole')
+    db_alias = schema_editor.connection.alias
+    seen = set()
+    duplicates = []
+    roles = SpaceRole.objects.using(db_alias).filter(
+        space__isnull=True
+    ).order_by('pk').values_list('pk', 'user_id', 'role')
+    for pk, user_id, role in roles.iterator():
+        if (user_id, role) in seen:
+            duplicates.append(pk)
+        seen.add((user_id, role))
+    SpaceRole.objects.using(db_alias).filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collab', '0006_action_target_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_managers, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='spacerole',
+            constraint=models.UniqueConstraint(condition=models.Q(space__isnull=True), fields=('user', 'role'), name='collab_role_unique_global'),
+        ),
+    ]
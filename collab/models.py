@@ -6,17 +6,139 @@ from django.db import models
 from django.utils import timezone
 
 
+class CollabQuerySet(models.QuerySet):
+
+    def active_since(self, since):
+        """
+        Users seen at or after the given datetime.
+        """
+        return self.filter(last_activity__gte=since)
+
+    def recently_active(self, minutes=5):
+        """
+        Users seen within the last minutes.
+        """
+        return self.active_since(timezone.now() - timedelta(minutes=minutes))
+
+    def inactive_since(self, since):
+        """
+        Users not seen since the given datetime.
+        """
+        return self.filter(last_activity__lt=since)
+
+    def in_space(self, space):
+        """
+        Restrict to the members of the given space.
+        """
+        return self.filter(user__groups=space.get_members())
+
+    def iter_keyset(self, chunk_size=1000, descending=False):
+        """
+        Iterates over all rows ordered by (last_activity, pk), fetching
+        chunk_size rows per query. Unlike OFFSET pagination, every chunk is
+        an index range scan, no matter how deep into the result it is.
+        """
+        if descending:
+            ordering = ('-last_activity', '-pk')
+            after = lambda c: models.Q(last_activity__lt=c.last_activity) | \
+                models.Q(last_activity=c.last_activity, pk__lt=c.pk)
+        else:
+            ordering = ('last_activity', 'pk')
+            after = lambda c: models.Q(last_activity__gt=c.last_activity) | \
+                models.Q(last_activity=c.last_activity, pk__gt=c.pk)
+        queryset = self.order_by(*ordering)
+        chunk = list(queryset[:chunk_size])
+        while chunk:
+            for collab in chunk:
+                yield collab
+            if len(chunk) < chunk_size:
+                break
+            chunk = list(queryset.filter(after(chunk[-1]))[:chunk_size])
+
+
 class Collab(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     is_manager = models.BooleanField(verbose_name="is Manager", default=False)
-    last_activity = models.DateTimeField(default=timezone.now)
+    last_activity = models.DateTimeField(default=timezone.now, db_index=True)
+
+    objects = CollabQuerySet.as_manager()
 
     def __str__(self):
         return self.user.username
 
-    def update_last_activity(self):
+    def last_activity_is_due(self, now=None):
+        """
+        Returns True if last_activity is older than
+        COLLAB_LAST_ACTIVITY_UPDATE_INTERVAL and should be refreshed.
+        """
         update_interval = getattr(settings, "COLLAB_LAST_ACTIVITY_UPDATE_INTERVAL", 600) # seconds
+        now = now or timezone.now()
+        return self.last_activity + timedelta(seconds=update_interval) < now
+
+    def update_last_activity(self):
         now = timezone.now()
-        if (self.last_activity - timedelta(seconds=update_interval)) < now:
+        if self.last_activity_is_due(now):
             self.last_activity = now
-            self.save()
+            self.save(update_fields=['last_activity'])
+
+
+class SpaceGroup(models.Model):
+    """
+    Maps the groups django-spaces creates for a Space to the Space and the
+    role they grant, so that queries can join a space to its admins.
+    Maintained by signals on Space, whether or not SpaceRole is enabled.
+    """
+    ADMIN = 'admin'
+    ROLE_CHOICES = (
+        (ADMIN, "Space admin"),
+    )
+
+    group = models.OneToOneField('auth.Group', on_delete=models.CASCADE,
+        related_name='collab_space_group')
+    space = models.ForeignKey('spaces.Space', on_delete=models.CASCADE,
+        related_name='collab_groups')
+    role = models.CharField(max_length=16, choices=ROLE_CHOICES)
+
+    def __str__(self):
+        return "%s: %s" % (self.space, self.role)
+
+
+class SpaceRole(models.Model):
+    """
+    Denormalized roles of users, so that role checks are a single indexed
+    lookup instead of combining Collab, group and space queries.
+    Space admins have one row per space. Managers have one row with an empty
+    space.
+
+    Only maintained with COLLAB_ROLE_TABLE = True. After enabling it, fill the
+    table with the rebuild_collab_roles management command.
+    """
+    MANAGER = 'manager'
+    ADMIN = SpaceGroup.ADMIN
+    ROLE_CHOICES = (
+        (MANAGER, "Manager"),
+        (ADMIN, "Space admin"),
+    )
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+        related_name='collab_roles')
+    space = models.ForeignKey('spaces.Space', on_delete=models.CASCADE,
+        null=True, blank=True, related_name='collab_roles')
+    role = models.CharField(max_length=16, choices=ROLE_CHOICES)
+
+    class Meta:
+        unique_together = (('user', 'role', 'space'),)
+        constraints = [
+            # unique_together doesn't cover the empty space of managers
+            models.UniqueConstraint(fields=['user', 'role'],
+                condition=models.Q(space__isnull=True),
+                name='collab_role_unique_global'),
+        ]
+        indexes = [
+            models.Index(fields=['space', 'role'], name='collab_role_space_idx'),
+        ]
+
+    def __str__(self):
+        if self.space_id is None:
+            return "%s: %s" % (self.user, self.role)
+        return "%s: %s of %s" % (self.user, self.role, self.space)
@@ -1,6 +1,55 @@
+import hashlib
+import re
+
+from django.conf import settings
+from django.core import signing
+from django.utils.module_loading import import_string
+
+from spaces.models import Space
+
+from .instrumentation import instrument
+from .resolver import get_resolver
+
+FILES_TOKEN_SALT = 'collab.permissions.files'
+
+
 class FilesPermissions(object):
-    
-    def has_read_permission(self, request, path):
+    """
+    Read permissions for files, e.g. for protected media serving.
+
+    Decisions are cached per request, keyed by user, space and the path
+    prefix returned by get_cache_prefix(). Extensions basing the permissions
+    on the path override has_path_permission() and, unless the decision is
+    the same for every path, get_cache_prefix().
+    """
+
+    def get_space_slug(self, path):
+        """
+        Returns the slug of the space the file at path belongs to, or None.
+        Matches path against COLLAB_FILES_SPACE_PATTERN, whose group 'space'
+        captures the slug.
+        """
+        match = re.match(getattr(settings, "COLLAB_FILES_SPACE_PATTERN",
+            r'^/media/protected/(?P<space>[-\w]+)/'), path)
+        return match.group('space') if match else None
+
+    def get_space(self, request, path):
+        """
+        Returns the space the file at path belongs to, or None.
+        """
+        slug = self.get_space_slug(path)
+        if slug is None:
+            return None
+        return Space.objects.filter(slug=slug).first()
+
+    def get_cache_prefix(self, path):
+        """
+        Returns the part of path the read decision depends on. The default
+        rules only depend on user and space, so all paths share a decision.
+        """
+        return ''
+
+    def has_path_permission(self, request, path):
         """
         Just return True if the user is an authenticated staff member.
         Extensions could base the permissions on the path too.
@@ -12,4 +61,67 @@ class FilesPermissions(object):
         if not hasattr(request,"SPACE") or not request.SPACE:
             return True
         # else obey space membership
-        return True if user.has_perm('access_space', request.SPACE) else False
+        return get_resolver(request).has_perm('access_space', request.SPACE)
+
+    @instrument('FilesPermissions.has_read_permission')
+    def has_read_permission(self, request, path):
+        """
+        Cached has_path_permission().
+        """
+        space = getattr(request, "SPACE", None)
+        key = (
+            type(self),
+            space.pk if space else None,
+            self.get_cache_prefix(path)
+        )
+        decisions = get_resolver(request).file_decisions
+        if key not in decisions:
+            decisions[key] = self.has_path_permission(request, path)
+        return decisions[key]
+
+    def filter_readable(self, request, paths):
+        """
+        Returns those of the given paths the user may read, in order.
+        """
+        return [path for path in paths if self.has_read_permission(request, path)]
+
+
+def get_files_permissions():
+    """
+    Returns an instance of the class given by COLLAB_FILES_PERMISSIONS.
+    """
+    return import_string(getattr(settings, "COLLAB_FILES_PERMISSIONS",
+        'collab.permissions.FilesPermissions'))()
+
+def _get_files_token_scope(request, files, path):
+    # bound to the session cookie, so that a token dies with the session,
+    # and to the space of the file, not to request.SPACE.
+    session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME, '')
+    return "%s:%s:%s" % (
+        hashlib.sha256(session_key.encode()).hexdigest(),
+        files.get_space_slug(path),
+        files.get_cache_prefix(path),
+    )
+
+def sign_files_token(request, files, path):
+    """
+    Returns a signed token granting read access to all paths sharing the
+    space and prefix of path in the current session.
+    """
+    return signing.TimestampSigner(salt=FILES_TOKEN_SALT).sign(
+        _get_files_token_scope(request, files, path)
+    )
+
+def check_files_token(request, files, path, token):
+    """
+    Returns True if token has been issued for the scope of path within the
+    last COLLAB_FILES_TOKEN_MAX_AGE seconds.
+    """
+    max_age = getattr(settings, "COLLAB_FILES_TOKEN_MAX_AGE", 300)
+    try:
+        scope = signing.TimestampSigner(salt=FILES_TOKEN_SALT).unsign(
+            token, max_age=max_age
+        )
+    except signing.BadSignature:
+        return False
+    return scope == _get_files_token_scope(request, files, path)
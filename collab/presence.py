@@ -0,0 +1,136 @@
+"""
+Presence backends used by LastActivityMiddleware to record when users have
+been seen and to answer which users are online.
+
+Select one with COLLAB_PRESENCE_BACKEND, e.g.
+'collab.presence.CachePresenceBackend'.
+"""
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .activity import LastActivityBuffer, last_activity_buffer
+from .models import Collab
+from .util import get_collab
+
+
+def get_online_timeout():
+    return getattr(settings, "COLLAB_PRESENCE_TIMEOUT", 300) # seconds
+
+
+class BasePresenceBackend(object):
+
+    def touch(self, user):
+        """
+        Record that the given authenticated user has just been seen.
+        """
+        raise NotImplementedError
+
+    def online_user_pks(self, user_pks):
+        """
+        Returns the set of those of the given user pks that have been seen
+        within the last COLLAB_PRESENCE_TIMEOUT seconds.
+        """
+        raise NotImplementedError
+
+
+class DatabasePresenceBackend(BasePresenceBackend):
+    """
+    Writes Collab.last_activity directly. The default.
+    """
+
+    def touch(self, user):
+        collab = get_collab(user)
+        if collab is not None:
+            collab.update_last_activity()
+
+    def online_user_pks(self, user_pks):
+        since = timezone.now() - timedelta(seconds=get_online_timeout())
+        return set(Collab.objects.filter(
+            user_id__in=user_pks
+        ).active_since(since).values_list('user_id', flat=True))
+
+
+class BufferedDatabasePresenceBackend(DatabasePresenceBackend):
+    """
+    Writes Collab.last_activity in batches through
+    collab.activity.last_activity_buffer. Used when
+    COLLAB_LAST_ACTIVITY_BUFFERED is set.
+    """
+
+    def touch(self, user):
+        collab = get_collab(user)
+        if collab is not None:
+            last_activity_buffer.touch(collab)
+
+
+class CachePresenceBackend(BasePresenceBackend):
+    """
+    Stores heartbeats in the cache given by COLLAB_PRESENCE_CACHE, expiring
+    after COLLAB_PRESENCE_TIMEOUT seconds, so that presence causes no
+    database traffic.
+
+    Collab.last_activity is still kept as durable history: it is refreshed
+    at most every COLLAB_LAST_ACTIVITY_UPDATE_INTERVAL seconds per user,
+    tracked in the heartbeat entry, and pending values are written in
+    batches on a background thread every COLLAB_PRESENCE_SYNC_INTERVAL
+    seconds. Recording presence needs neither the Collab instance nor any
+    query on the request thread.
+    """
+
+    def __init__(self):
+        self.buffer = LastActivityBuffer(
+            flush_interval=getattr(settings, "COLLAB_PRESENCE_SYNC_INTERVAL", 600),
+            background=True
+        )
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, "COLLAB_PRESENCE_CACHE", 'default')]
+
+    def get_key(self, user_pk):
+        return 'collab:presence:%s' % user_pk
+
+    def touch(self, user):
+        now = timezone.now()
+        key = self.get_key(user.pk)
+        # heartbeats are (last seen, last written to Collab.last_activity)
+        heartbeat = self.cache.get(key)
+        synced = heartbeat[1] if heartbeat is not None else None
+        update_interval = getattr(settings, "COLLAB_LAST_ACTIVITY_UPDATE_INTERVAL", 600)
+        if synced is None or synced + timedelta(seconds=update_interval) < now:
+            self.buffer.touch_user(user.pk, now)
+            synced = now
+        self.cache.set(key, (now, synced), get_online_timeout())
+
+    def last_seen(self, user_pk):
+        """
+        Returns the time the user has been last seen, if within the timeout.
+        """
+        heartbeat = self.cache.get(self.get_key(user_pk))
+        return heartbeat[0] if heartbeat is not None else None
+
+    def online_user_pks(self, user_pks):
+        keys = dict((self.get_key(pk), pk) for pk in user_pks)
+        return set(keys[key] for key in self.cache.get_many(list(keys)))
+
+
+@lru_cache(maxsize=None)
+def _load_backend(path):
+    return import_string(path)()
+
+def get_presence_backend():
+    """
+    Returns the configured presence backend instance.
+    """
+    path = getattr(settings, "COLLAB_PRESENCE_BACKEND", None)
+    if path is None:
+        if getattr(settings, "COLLAB_LAST_ACTIVITY_BUFFERED", False):
+            path = 'collab.presence.BufferedDatabasePresenceBackend'
+        else:
+            path = 'collab.presence.DatabasePresenceBackend'
+    return _load_backend(path)
@@ -0,0 +1,105 @@
+import threading
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from .models import Collab
+from .roles import add_managers, role_table_enabled
+
+_deferred = threading.local()
+
+
+def get_deferred_collabs():
+    """
+    Returns the list collecting Collab instances inside the innermost
+    defer_collab_creation() block of this thread, or None outside of it.
+    """
+    stack = getattr(_deferred, 'stack', None)
+    return stack[-1] if stack else None
+
+@contextmanager
+def defer_collab_creation(batch_size=1000):
+    """
+    Context manager for mass imports. Inside the block the user post_save
+    receiver only collects the Collab extensions of new users. When the block
+    is left without an exception, they are created with bulk INSERTs of
+    batch_size rows.
+
+    with defer_collab_creation():
+        for row in rows:
+            User.objects.create_user(**row)
+    """
+    if not hasattr(_deferred, 'stack'):
+        _deferred.stack = []
+    _deferred.stack.append([])
+    try:
+        yield
+    finally:
+        collabs = _deferred.stack.pop()
+    Collab.objects.bulk_create(
+        collabs, batch_size=batch_size, ignore_conflicts=True
+    )
+    if role_table_enabled():
+        add_managers(
+            collab.user_id for collab in collabs if collab.is_manager
+        )
+
+def bulk_create_users(users, is_manager=False, batch_size=1000):
+    """
+    Saves the given unsaved user instances with bulk INSERTs and creates their
+    Collab extensions the same way. Users saved by bulk_create() don't send
+    post_save, so this is the way to provision many accounts at once.
+
+    Returns the list of saved users.
+    """
+    UserModel = get_user_model()
+    manager = UserModel._default_manager
+    with transaction.atomic():
+        users = manager.bulk_create(users, batch_size=batch_size)
+        unsaved = [user for user in users if user.pk is None]
+        if unsaved:
+            # not every database backend returns pks from bulk inserts
+            field = UserModel.USERNAME_FIELD
+            for start in range(0, len(unsaved), batch_size):
+                chunk = unsaved[start:start + batch_size]
+                pks = dict(manager.filter(**{
+                    '%s__in' % field: [getattr(user, field) for user in chunk]
+                }).values_list(field, 'pk'))
+                for user in chunk:
+                    user.pk = pks[getattr(user, field)]
+        Collab.objects.bulk_create(
+            [Collab(user_id=user.pk, is_manager=is_manager) for user in users],
+            batch_size=batch_size
+        )
+        if is_manager and role_table_enabled():
+            add_managers(user.pk for user in users)
+    return users
+
+
+def create_missing_collabs(batch_size=10000):
+    """
+    Creates the Collab extension for every user that doesn't have one yet,
+    e.g. users created before collab got installed.
+
+    Users are processed in chunks of batch_size ordered by pk, with one
+    bulk INSERT per chunk. Returns the number of users processed.
+    """
+    UserModel = get_user_model()
+    missing = UserModel._default_manager.filter(
+        collab__isnull=True
+    ).order_by('pk').values_list('pk', flat=True)
+    count = 0
+    last_pk = None
+    while True:
+        chunk = missing if last_pk is None else missing.filter(pk__gt=last_pk)
+        user_pks = list(chunk[:batch_size])
+        if not user_pks:
+            break
+        Collab.objects.bulk_create(
+            [Collab(user_id=pk) for pk in user_pks],
+            ignore_conflicts=True
+        )
+        count += len(user_pks)
+        last_pk = user_pks[-1]
+    return count
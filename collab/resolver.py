@@ -0,0 +1,160 @@
+from spaces.models import Space
+
+from .index import space_admin_ids
+from .models import Collab
+from .snapshot import get_snapshot, snapshots_enabled
+from .util import has_manager_role, is_space_admin
+
+
+_UNLOADED = object()
+SPACE_ACCESS_PERMS = ('access_space', 'spaces.access_space')
+
+
+class PermissionResolver(object):
+    """
+    Memoizes the permission facts collab checks for a single user, so that
+    stacked decorators, mixins and template filters only hit the database
+    once per fact.
+
+    A resolver lives on the user instance it has been created for. Within a
+    request cycle that is request.user, so decisions are cached for the
+    duration of the request.
+
+    With COLLAB_ROLE_SNAPSHOT enabled, resolvers of request users answer
+    manager, admin and space access checks from the session's role snapshot,
+    see collab.snapshot.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.snapshot_loader = None
+        self._snapshot = _UNLOADED
+        self._space_admin = {}
+        self._perms = {}
+        # FilesPermissions decisions, see collab.permissions
+        self.file_decisions = {}
+
+    @classmethod
+    def for_user(cls, user):
+        """
+        Returns the resolver attached to the given user, creating it if needed.
+        """
+        resolver = getattr(user, '_collab_perms', None)
+        if resolver is None:
+            resolver = cls(user)
+            user._collab_perms = resolver
+        return resolver
+
+    @property
+    def snapshot(self):
+        if self._snapshot is _UNLOADED:
+            # None while loading, so that computing the snapshot doesn't
+            # recurse into it.
+            self._snapshot = None
+            if self.snapshot_loader is not None:
+                self._snapshot = self.snapshot_loader()
+        return self._snapshot
+
+    @property
+    def is_authenticated(self):
+        return bool(self.user and self.user.is_authenticated)
+
+    @property
+    def is_superuser(self):
+        return self.is_authenticated and self.user.is_superuser
+
+    @property
+    def is_manager(self):
+        if not self.is_authenticated:
+            return False
+        if self.snapshot is not None:
+            return self.snapshot.is_manager
+        return has_manager_role(self.user)
+
+    def is_space_admin(self, space):
+        """
+        Returns True if the user is in the admin group of the given space.
+        """
+        if not self.is_authenticated or space is None:
+            return False
+        if space.pk not in self._space_admin:
+            self._space_admin[space.pk] = is_space_admin(self.user, space)
+        return self._space_admin[space.pk]
+
+    def set_space_admin(self, space, is_admin):
+        """
+        Store a space admin decision computed elsewhere, e.g. in bulk.
+        """
+        self._space_admin[space.pk] = is_admin
+
+    def is_space_admin_or_manager(self, space):
+        return self.is_manager or self.is_space_admin(space)
+
+    def has_perm(self, perm, obj=None, accept_global_perms=False):
+        """
+        Memoized user.has_perm(perm, obj). With accept_global_perms, a global
+        permission is sufficient, like in guardian's get_40x_or_None.
+        """
+        key = (
+            perm,
+            obj._meta.label if obj is not None else None,
+            obj.pk if obj is not None else None,
+            accept_global_perms
+        )
+        if key not in self._perms and not accept_global_perms and \
+            perm in SPACE_ACCESS_PERMS and isinstance(obj, Space) and \
+            self.snapshot is not None:
+            self._perms[key] = self.snapshot.can_access(obj.pk)
+        if key not in self._perms:
+            allowed = accept_global_perms and self.user.has_perm(perm)
+            if not allowed:
+                allowed = self.user.has_perm(perm, obj)
+            self._perms[key] = bool(allowed)
+        return self._perms[key]
+
+
+def get_resolver(request):
+    """
+    Returns the PermissionResolver for request.user and makes it available as
+    request.collab_perms.
+    """
+    resolver = getattr(request, 'collab_perms', None)
+    if resolver is None or resolver.user is not request.user:
+        resolver = PermissionResolver.for_user(request.user)
+        if snapshots_enabled() and resolver.snapshot_loader is None:
+            resolver.snapshot_loader = lambda: get_snapshot(request)
+        request.collab_perms = resolver
+    return resolver
+
+def prime_roles(users, space):
+    """
+    Computes manager and admin roles of many users in the given space at once
+    and stores them in each user's resolver, so that later checks and
+    template filters on these user instances need no queries.
+
+    Returns a dict mapping user pks to dicts with the keys 'is_superuser',
+    'is_manager' and 'is_admin'.
+    """
+    users = [user for user in users if user is not None and user.pk is not None]
+    collab_cache = Collab._meta.get_field('user').remote_field
+    missing = [user.pk for user in users if not collab_cache.is_cached(user)]
+    if missing:
+        collabs = dict(
+            (collab.user_id, collab)
+            for collab in Collab.objects.filter(user_id__in=missing)
+        )
+        for user in users:
+            if not collab_cache.is_cached(user):
+                collab_cache.set_cached_value(user, collabs.get(user.pk))
+    admin_ids = space_admin_ids(space) if space is not None else frozenset()
+    roles = {}
+    for user in users:
+        resolver = PermissionResolver.for_user(user)
+        if space is not None:
+            resolver.set_space_admin(space, user.pk in admin_ids)
+        roles[user.pk] = {
+            'is_superuser': resolver.is_superuser,
+            'is_manager': resolver.is_manager,
+            'is_admin': user.pk in admin_ids,
+        }
+    return roles
@@ -0,0 +1,132 @@
+"""
+Maintenance of the denormalized SpaceRole table.
+
+The receivers in collab.signals call these functions while
+COLLAB_ROLE_TABLE is enabled. rebuild_roles() recreates the whole table.
+SpaceGroup rows are recorded regardless, see record_space_group().
+"""
+from django.conf import settings
+from django.db import transaction
+
+from .models import Collab, SpaceGroup, SpaceRole
+
+
+def role_table_enabled():
+    return getattr(settings, "COLLAB_ROLE_TABLE", False)
+
+def _sync(queryset, field, wanted, make_role):
+    """
+    Adds and removes SpaceRole rows in queryset, so that the values of field
+    match wanted.
+    """
+    existing = set(queryset.values_list(field, flat=True))
+    wanted = set(wanted)
+    if existing - wanted:
+        queryset.filter(**{'%s__in' % field: existing - wanted}).delete()
+    if wanted - existing:
+        SpaceRole.objects.bulk_create(
+            [make_role(value) for value in wanted - existing],
+            ignore_conflicts=True
+        )
+
+def record_space_group(space):
+    """
+    Records the admin group of the given space in SpaceGroup and returns it.
+    """
+    group = space.get_admins()
+    SpaceGroup.objects.update_or_create(
+        group=group, defaults={'space': space, 'role': SpaceGroup.ADMIN}
+    )
+    return group
+
+def record_missing_space_groups(using=None):
+    """
+    Records the admin groups of spaces which have none in SpaceGroup, e.g.
+    because they were created before collab kept track of them.
+    """
+    from spaces.models import Space
+    spaces = Space.objects.filter(collab_groups__isnull=True)
+    if using is not None:
+        spaces = spaces.using(using)
+    for space in spaces.iterator():
+        record_space_group(space)
+
+def sync_space(space):
+    """
+    Records the admin group of the given space and syncs its admin roles.
+    """
+    sync_space_group(space.pk, record_space_group(space))
+
+def sync_space_group(space_pk, group):
+    """
+    Syncs the admin roles of a space with the members of its admin group.
+    """
+    _sync(
+        SpaceRole.objects.filter(space_id=space_pk, role=SpaceRole.ADMIN),
+        'user_id',
+        group.user_set.values_list('pk', flat=True),
+        lambda user_pk: SpaceRole(
+            user_id=user_pk, space_id=space_pk, role=SpaceRole.ADMIN
+        )
+    )
+
+def sync_group(group):
+    """
+    Syncs the admin roles granted by the given group, if it is the admin
+    group of a space.
+    """
+    space_group = SpaceGroup.objects.filter(
+        group=group, role=SpaceGroup.ADMIN
+    ).first()
+    if space_group is not None:
+        sync_space_group(space_group.space_id, group)
+
+def sync_user(user):
+    """
+    Syncs the admin roles of a user with their groups.
+    """
+    _sync(
+        SpaceRole.objects.filter(user=user, role=SpaceRole.ADMIN),
+        'space_id',
+        SpaceGroup.objects.filter(
+            group__user=user, role=SpaceGroup.ADMIN
+        ).values_list('space_id', flat=True),
+        lambda space_pk: SpaceRole(
+            user=user, space_id=space_pk, role=SpaceRole.ADMIN
+        )
+    )
+
+def sync_manager(collab):
+    """
+    Syncs the manager role of a user with Collab.is_manager.
+    """
+    roles = SpaceRole.objects.filter(
+        user_id=collab.user_id, role=SpaceRole.MANAGER
+    )
+    if not collab.is_manager:
+        roles.delete()
+    elif not roles.exists():
+        add_managers([collab.user_id])
+
+def add_managers(user_pks):
+    """
+    Adds the manager role for the given user pks, for Collab rows created in
+    bulk without post_save.
+    """
+    SpaceRole.objects.bulk_create([
+        SpaceRole(user_id=pk, role=SpaceRole.MANAGER) for pk in user_pks
+    ], batch_size=1000, ignore_conflicts=True)
+
+def rebuild_roles():
+    """
+    Recreates SpaceGroup and SpaceRole from scratch.
+    """
+    from spaces.models import Space
+    with transaction.atomic():
+        SpaceRole.objects.all().delete()
+        SpaceGroup.objects.all().delete()
+        for space in Space.objects.all().iterator():
+            sync_space(space)
+        add_managers(Collab.objects.filter(
+            is_manager=True
+        ).values_list('user_id', flat=True).iterator())
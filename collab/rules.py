@@ -0,0 +1,69 @@
+"""
+Short-circuit rules for collab's permission_required decorator.
+
+A rule is a callable rule(request, perm, obj) returning True to grant,
+False to deny or None to pass on to the next rule. The rules listed in
+COLLAB_PERMISSION_SHORT_CIRCUITS are evaluated in order before guardian is
+asked, so they should only rely on facts which are cheap to get. If no rule
+decides, guardian's object permissions apply.
+"""
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .resolver import get_resolver
+
+DEFAULT_RULES = (
+    'collab.rules.anonymous',
+    'collab.rules.superuser',
+    'collab.rules.manager',
+)
+
+
+def anonymous(request, perm, obj):
+    """
+    Anonymous users are denied (and sent to the login page). Remove this rule
+    if you grant object permissions to guardian's anonymous user.
+    """
+    if not request.user.is_authenticated:
+        return False
+    return None
+
+def superuser(request, perm, obj):
+    """
+    Active superusers have all permissions, like in Django and guardian.
+    """
+    if request.user.is_active and request.user.is_superuser:
+        return True
+    return None
+
+def manager(request, perm, obj):
+    """
+    Managers have the permissions listed in COLLAB_MANAGER_PERMS in every
+    space.
+    """
+    manager_perms = getattr(settings, "COLLAB_MANAGER_PERMS", ('access_space',))
+    if perm in manager_perms and get_resolver(request).is_manager:
+        return True
+    return None
+
+
+@lru_cache(maxsize=None)
+def _load_rules(paths):
+    return tuple(import_string(path) for path in paths)
+
+def get_rules():
+    return _load_rules(tuple(
+        getattr(settings, "COLLAB_PERMISSION_SHORT_CIRCUITS", DEFAULT_RULES)
+    ))
+
+def evaluate(request, perm, obj):
+    """
+    Returns the decision of the first rule deciding on perm, or None.
+    """
+    for rule in get_rules():
+        decision = rule(request, perm, obj)
+        if decision is not None:
+            return decision
+    return None
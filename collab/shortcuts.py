@@ -1,4 +1,15 @@
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import BooleanField, Case, CharField, Exists, \
+    OuterRef, Q, Value, When
+from django.db.models.functions import Cast
 from guardian.shortcuts import get_objects_for_user as gofu
+from guardian.utils import get_anonymous_user, get_group_obj_perms_model, \
+    get_user_obj_perms_model
+
+from .models import SpaceGroup, SpaceRole
+from .roles import role_table_enabled
+from .util import has_manager_role
 
 def get_objects_for_user(user, perms, klass=None, use_groups=True, 
         any_perm=False, with_superuser=True, accept_global_perms=True):
@@ -11,8 +22,154 @@ def get_objects_for_user(user, perms, klass=None, use_groups=True,
     overkill.
     """
 
-    if user.collab.is_manager and klass is not None:
+    if klass is not None and has_manager_role(user):
         return klass.objects.all()
     else:
         return gofu(user, perms, klass, use_groups,
-            any_perm, with_superuser, accept_global_perms)
\ No newline at end of file
+            any_perm, with_superuser, accept_global_perms)
+
+def iter_objects_for_user(user, perms, klass, chunk_size=None, ids_only=False,
+        use_groups=True, any_perm=False, with_superuser=True,
+        accept_global_perms=True):
+    """
+    Streaming variant of get_objects_for_user for exports and reports.
+    Yields the permitted objects of klass, or only their pks with ids_only,
+    fetched in chunks of chunk_size (default COLLAB_ITER_CHUNK_SIZE, 2000)
+    through QuerySet.iterator(), i.e. a server-side cursor where the
+    database supports it.
+
+    Object permissions are checked in EXISTS subqueries of the streamed
+    query, see perm_exists, instead of collecting the permitted pks first.
+    """
+    if chunk_size is None:
+        chunk_size = getattr(settings, "COLLAB_ITER_CHUNK_SIZE", 2000)
+    queryset = _permitted_objects(user, perms, klass, use_groups, any_perm,
+        with_superuser, accept_global_perms)
+    if ids_only:
+        queryset = queryset.values_list('pk', flat=True)
+    return queryset.iterator(chunk_size=chunk_size)
+
+def _permitted_objects(user, perms, klass, use_groups, any_perm,
+        with_superuser, accept_global_perms):
+    queryset = klass.objects.all()
+    if user.is_authenticated and (
+        (with_superuser and user.is_active and user.is_superuser) or
+        has_manager_role(user)
+    ):
+        return queryset
+    if isinstance(perms, str):
+        perms = [perms]
+    codenames = [perm.split('.', 1)[-1] for perm in perms]
+    if accept_global_perms:
+        # like guardian, global permissions grant access to every object
+        granted = [
+            codename for codename in codenames
+            if user.has_perm('%s.%s' % (klass._meta.app_label, codename))
+        ]
+        if granted and (any_perm or len(granted) == len(codenames)):
+            return queryset
+        codenames = [codename for codename in codenames if codename not in granted]
+    names = []
+    for codename in codenames:
+        name = '_collab_can_%s' % codename
+        queryset = queryset.annotate(**{
+            name: perm_exists(user, klass, codename, use_groups)
+        })
+        names.append(name)
+    if any_perm:
+        condition = Q()
+        for name in names:
+            condition |= Q(**{name: True})
+        return queryset.filter(condition)
+    return queryset.filter(**dict((name, True) for name in names))
+
+def _object_perm_exists(perm_model, model, codename, **lookups):
+    """
+    Returns an Exists() expression matching rows of the given guardian
+    permission model which grant codename on the outer object.
+    """
+    ctype = ContentType.objects.get_for_model(model)
+    queryset = perm_model.objects.filter(
+        permission__content_type=ctype,
+        permission__codename=codename,
+        **lookups
+    )
+    if perm_model.objects.is_generic():
+        queryset = queryset.filter(
+            content_type=ctype,
+            object_pk=Cast(OuterRef('pk'), CharField())
+        )
+    else:
+        queryset = queryset.filter(content_object=OuterRef('pk'))
+    return Exists(queryset)
+
+def perm_exists(user, model, perm, use_groups=True):
+    """
+    Returns a boolean expression which is True for objects of the given model
+    on which the user has the object permission perm, either directly or
+    through one of their groups.
+    """
+    codename = perm.split('.', 1)[-1]
+    if user.is_anonymous:
+        user = get_anonymous_user()
+    conditions = [When(
+        _object_perm_exists(
+            get_user_obj_perms_model(model), model, codename, user=user
+        ),
+        then=Value(True)
+    )]
+    if use_groups:
+        conditions.append(When(
+            _object_perm_exists(
+                get_group_obj_perms_model(model), model, codename,
+                group__user=user
+            ),
+            then=Value(True)
+        ))
+    return Case(*conditions, default=Value(False), output_field=BooleanField())
+
+def annotate_permissions(user, queryset, perms=('access_space',),
+        with_admin=False):
+    """
+    Annotates every object in queryset with the user's access, using
+    subqueries instead of per-object checks:
+
+    - 'can_<codename>' for each permission in perms.
+    - 'is_admin' if with_admin is set. Only valid for Space querysets.
+
+    Like get_objects_for_user, superusers and managers get True everywhere.
+
+    Example:
+
+    spaces = annotate_permissions(request.user, Space.objects.all(),
+        with_admin=True)
+    for space in spaces:
+        if space.can_access_space: [...]
+    """
+    model = queryset.model
+    has_full_access = user.is_authenticated and (
+        (user.is_active and user.is_superuser) or
+        has_manager_role(user)
+    )
+    annotations = {}
+    for perm in perms:
+        name = 'can_%s' % perm.split('.', 1)[-1]
+        if has_full_access:
+            annotations[name] = Value(True, output_field=BooleanField())
+        else:
+            annotations[name] = perm_exists(user, model, perm)
+    if with_admin:
+        if has_full_access:
+            annotations['is_admin'] = Value(True, output_field=BooleanField())
+        elif user.pk is None:
+            annotations['is_admin'] = Value(False, output_field=BooleanField())
+        elif role_table_enabled():
+            annotations['is_admin'] = Exists(SpaceRole.objects.filter(
+                user_id=user.pk, space_id=OuterRef('pk'), role=SpaceRole.ADMIN
+            ))
+        else:
+            annotations['is_admin'] = Exists(SpaceGroup.objects.filter(
+                space_id=OuterRef('pk'), role=SpaceGroup.ADMIN,
+                group__user=user.pk
+            ))
+    return queryset.annotate(**annotations)
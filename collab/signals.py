@@ -1,11 +1,24 @@
 from django.conf import settings
-from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, \
+    post_save
 from django.dispatch import receiver
 
 from actstream.signals import action
+from guardian.models import GroupObjectPermission, UserObjectPermission
 from spaces.models import Space
+from . import index, roles, snapshot
+from .actions import action_queue
 from .models import Collab
+from .provisioning import get_deferred_collabs
+from .util import clear_introspection_cache
+
+def _is_activity_update(update_fields):
+    # Collab.update_last_activity() saves on every request of active users,
+    # without changing any role.
+    return update_fields is not None and \
+        set(update_fields) <= set(['last_activity'])
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def auth_post_save_reveiver(sender, instance, created, **kwargs):
@@ -13,9 +26,98 @@ def auth_post_save_reveiver(sender, instance, created, **kwargs):
         myargs = {}
         if "is_manager" in kwargs.keys():
             myargs["is_manager"] = kwargs["is_manager"]
+        deferred = get_deferred_collabs()
+        if deferred is not None:
+            deferred.append(Collab(user=instance, **myargs))
+            return
         Collab.objects.create(user=instance, **myargs)
 
 @receiver(post_save, sender=Space)
 def space_post_save_receiver(sender, instance, created, **kwargs):
     verb = "was created" if created == True else "was updated"
-    action.send(instance, verb=verb)
\ No newline at end of file
+    if getattr(settings, "COLLAB_DEFERRED_ACTIONS", False):
+        action_queue.enqueue(instance, verb)
+    else:
+        action.send(instance, verb=verb)
+
+@receiver(post_save, sender=Space)
+@receiver(post_delete, sender=Space)
+def space_admin_index_receiver(sender, instance, **kwargs):
+    index.invalidate_space(instance.pk)
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+def user_groups_changed_receiver(sender, action, **kwargs):
+    # we can't tell cheaply which Space an arbitrary group belongs to, so any
+    # membership change invalidates the whole admin index.
+    if action in ("post_add", "post_remove", "post_clear"):
+        index.invalidate_all()
+
+@receiver(post_migrate)
+def post_migrate_receiver(sender, using=None, **kwargs):
+    clear_introspection_cache(using)
+    # with all apps migrated, the live Space model matches the schema
+    if sender.name == 'collab':
+        roles.record_missing_space_groups(using)
+
+@receiver(post_save, sender=Space)
+def space_role_receiver(sender, instance, **kwargs):
+    if roles.role_table_enabled():
+        roles.sync_space(instance)
+    else:
+        roles.record_space_group(instance)
+
+@receiver(post_save, sender=Collab)
+def collab_role_receiver(sender, instance, update_fields=None, **kwargs):
+    if roles.role_table_enabled() and not _is_activity_update(update_fields):
+        roles.sync_manager(instance)
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+def user_groups_role_receiver(sender, instance, action, reverse, **kwargs):
+    if not roles.role_table_enabled() or \
+        action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if reverse:
+        roles.sync_group(instance)
+    else:
+        roles.sync_user(instance)
+
+@receiver(user_logged_in)
+def role_snapshot_login_receiver(sender, request, user, **kwargs):
+    if snapshot.snapshots_enabled() and hasattr(request, 'session'):
+        snapshot.store_snapshot(request, user)
+
+@receiver(post_save, sender=Collab)
+def collab_snapshot_receiver(sender, instance, update_fields=None, **kwargs):
+    if not _is_activity_update(update_fields):
+        snapshot.bump_user(instance.user_id)
+
+@receiver(post_save, sender=UserObjectPermission)
+@receiver(post_delete, sender=UserObjectPermission)
+def user_permission_snapshot_receiver(sender, instance, **kwargs):
+    snapshot.bump_user(instance.user_id)
+
+@receiver(post_delete, sender=Space)
+@receiver(post_save, sender=GroupObjectPermission)
+@receiver(post_delete, sender=GroupObjectPermission)
+def global_snapshot_receiver(sender, instance, **kwargs):
+    snapshot.bump_all()
+
+@receiver(post_save, sender=Space)
+def space_snapshot_receiver(sender, instance, created, **kwargs):
+    # editing a space doesn't change who may access or administer it
+    if created:
+        snapshot.bump_all()
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+def user_groups_snapshot_receiver(sender, instance, action, reverse, pk_set,
+    **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        snapshot.bump_user(instance.pk)
+    elif pk_set:
+        for user_pk in pk_set:
+            snapshot.bump_user(user_pk)
+    else:
+        # a cleared group doesn't tell which users it had
+        snapshot.bump_all()
@@ -0,0 +1,135 @@
+"""
+Role snapshots: the manager flag and the administered and accessible spaces
+of a user, computed at login and kept in the session.
+
+A snapshot is valid as long as the version it has been computed for is
+current. Versions are kept in the cache COLLAB_ROLE_SNAPSHOT_CACHE and
+bumped by the receivers in collab.signals: per user on Collab saves, group
+membership and user permission changes, globally on Space creation and
+deletion and group permission changes.
+
+Enable with COLLAB_ROLE_SNAPSHOT = True.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+SESSION_KEY = '_collab_roles'
+GENERATION_KEY = 'collab:roles:generation'
+
+
+def snapshots_enabled():
+    return getattr(settings, "COLLAB_ROLE_SNAPSHOT", False)
+
+def _get_cache():
+    return caches[getattr(settings, "COLLAB_ROLE_SNAPSHOT_CACHE", 'default')]
+
+def _get_user_key(user_pk):
+    return 'collab:roles:version:%s' % user_pk
+
+def get_version(user_pk):
+    """
+    Returns the current [generation, user version] of the given user.
+    """
+    cache = _get_cache()
+    keys = [GENERATION_KEY, _get_user_key(user_pk)]
+    values = cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            # start from a fresh value, so that snapshots of an evicted
+            # version never become valid again.
+            cache.add(key, int(time.time() * 1000), None)
+            values[key] = cache.get(key)
+    return [values[key] for key in keys]
+
+def _bump(key):
+    cache = _get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, int(time.time() * 1000), None)
+
+def bump_user(user_pk):
+    """
+    Invalidates the snapshots of a single user.
+    """
+    if snapshots_enabled():
+        _bump(_get_user_key(user_pk))
+
+def bump_all():
+    """
+    Invalidates the snapshots of all users.
+    """
+    if snapshots_enabled():
+        _bump(GENERATION_KEY)
+
+
+class RoleSnapshot(object):
+    """
+    The roles of a user. space_pks is None for managers, who may access every
+    space.
+    """
+
+    def __init__(self, version, is_manager, admin_space_pks, space_pks):
+        self.version = list(version)
+        self.is_manager = is_manager
+        self.admin_space_pks = frozenset(admin_space_pks)
+        self.space_pks = None if space_pks is None else frozenset(space_pks)
+
+    def can_access(self, space_pk):
+        return self.space_pks is None or space_pk in self.space_pks
+
+    def as_dict(self):
+        return {
+            'version': self.version,
+            'is_manager': self.is_manager,
+            'admin_space_pks': sorted(self.admin_space_pks),
+            'space_pks': None if self.space_pks is None else sorted(self.space_pks),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['version'], data['is_manager'],
+            data['admin_space_pks'], data['space_pks'])
+
+
+def compute_snapshot(user):
+    from spaces.models import Space
+    from .shortcuts import get_objects_for_user
+    from .util import administered_space_pks, has_manager_role
+    version = get_version(user.pk)
+    is_manager = has_manager_role(user)
+    space_pks = None
+    if not is_manager:
+        space_pks = get_objects_for_user(
+            user, 'access_space', Space, accept_global_perms=False
+        ).values_list('pk', flat=True)
+    return RoleSnapshot(
+        version,
+        is_manager,
+        administered_space_pks(user),
+        space_pks
+    )
+
+def store_snapshot(request, user):
+    """
+    Computes the snapshot of user and stores it in the session.
+    """
+    snapshot = compute_snapshot(user)
+    request.session[SESSION_KEY] = snapshot.as_dict()
+    return snapshot
+
+def get_snapshot(request):
+    """
+    Returns the snapshot of request.user, recomputing it if it is missing or
+    stale. Returns None for anonymous users or if snapshots are disabled.
+    """
+    user = request.user
+    if not snapshots_enabled() or not user.is_authenticated or \
+        not hasattr(request, 'session'):
+        return None
+    data = request.session.get(SESSION_KEY)
+    if data is not None and data['version'] == get_version(user.pk):
+        return RoleSnapshot.from_dict(data)
+    return store_snapshot(request, user)
@@ -1,62 +1,59 @@
 from django import template
 from django.template.base import TemplateSyntaxError
-from spaces.models import Space, SpacePluginRegistry
+from django.utils.html import conditional_escape
+
+from ..resolver import PermissionResolver, prime_roles
+from ..util import get_action_url, has_manager_role
 
 register = template.Library()
 
-class ActionNode(template.defaulttags.URLNode):
-    def __init__(self,action, args, kwargs, asvar):
-        self.action = template.Variable(action)
-        return super(ActionNode,self).__init__(action, args, kwargs, asvar)
-
-    def render(self,context):
-        try:
-            action = self.action.resolve(context)
-            if isinstance(action, Space):
-                retval =  '/%s/' % action.slug
-            else:
-                retval = ''
-        except template.VariableDoesNotExist:
-            retval =  ''
+class ActionNode(template.Node):
+    def __init__(self, action, asvar):
+        self.action = action
+        self.asvar = asvar
+
+    def render(self, context):
+        action = self.action.resolve(context)
+        retval = ''
+        if hasattr(action, '_meta'):
+            # activity streams repeat the same actors and targets, so URLs
+            # are cached for the duration of the render.
+            urls = context.render_context.setdefault('collab_action_urls', {})
+            key = (action._meta.label, action.pk)
+            if key not in urls:
+                urls[key] = get_action_url(action)
+            retval = urls[key]
         if self.asvar:
             context[self.asvar] = retval
             return ''
+        if context.autoescape:
+            retval = conditional_escape(retval)
         return retval
 
 @register.tag
 def action_url(parser, token):
     """
     Try to get a url for the given actstream actor, object or target.
+
+    Usage example:
+
+    {% action_url action.target %}
+    {% action_url action.action_object as url %}
+
+    See collab.util.register_action_url for how URLs are built.
     """
-    bits = token.contents.split()
+    bits = token.split_contents()
     if len(bits) < 2:
         raise TemplateSyntaxError("'%s' takes at least one arguments"
                                   " (action)" % bits[0])
-    action = bits[1]
-    #viewname = parser.compile_filter(bits[1])
-    args = []
-    kwargs = {}
+    action = parser.compile_filter(bits[1])
     asvar = None
     bits = bits[2:]
-
-
-
     if len(bits) >= 2 and bits[-2] == 'as':
         asvar = bits[-1]
-        bits = bits[:-2]
-
-    if len(bits):
-        for bit in bits:
-            match = template.base.kwarg_re.match(bit)
-            if not match:
-                raise TemplateSyntaxError("Malformed arguments to action_url tag")
-            name, value = match.groups()
-            if name:
-                kwargs[name] = parser.compile_filter(value)
-            else:
-                args.append(parser.compile_filter(value))
-
-    return ActionNode(action, args, kwargs, asvar)
+    # any further arguments are accepted for backwards compatibility, but
+    # have never been used.
+    return ActionNode(action, asvar)
 
 
 @register.filter(name="is_manager")
@@ -64,7 +61,7 @@ def is_manager(user):
     """
     returns True if user has is_manager permissions or more, else False.
     """
-    return user.is_superuser or user.collab.is_manager
+    return user.is_superuser or has_manager_role(user)
 
 @register.filter(name="is_admin_or_manager")
 def is_admin_or_manager(user, space):
@@ -79,17 +76,41 @@ def is_admin_or_manager(user, space):
     Is True for a superuser who is not a member in the 'admin' group of this
     space.
     """
-    if user and space:
-        admins = space.get_admins().user_set.all()
-    else:
+    if not user or not space:
         return False
-    ret = False
-    if user in admins or user.is_superuser or \
-        hasattr(user, 'collab') and user.collab.is_manager:
-        ret = True
-    return ret
+    resolver = PermissionResolver.for_user(user)
+    return resolver.is_superuser or resolver.is_space_admin_or_manager(space)
 
 
+@register.simple_tag
+def collab_roles(users, space):
+    """
+    Computes the roles of many users in a space with a few queries instead of
+    several per user. Afterwards, the is_manager and is_admin_or_manager
+    filters answer from the precomputed data for these user instances.
+
+    Usage example:
+
+    {% with members=space.get_members.user_set.all %}
+      {% collab_roles members space as roles %}
+      {% for member in members %}
+        {% if member|is_admin_or_manager:space %}Space Admin{% endif %}
+        {% with role=roles|role_of:member %}{{ role.is_manager }}{% endwith %}
+      {% endfor %}
+    {% endwith %}
+
+    Iterate over the same users variable, or the template gets fresh user
+    instances without the precomputed data.
+    """
+    return prime_roles(users, space)
+
+@register.filter(name="role_of")
+def role_of(roles, user):
+    """
+    Returns the roles of user from the output of collab_roles.
+    """
+    return roles.get(getattr(user, 'pk', None), {})
+
 @register.filter(name="verbose_name")
 def verbose_name(value):
     return value._meta.verbose_name
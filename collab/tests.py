@@ -1,16 +1,45 @@
+import asyncio
+import json
 try:
     from unittest import mock
 except ImportError:
     import mock
+from datetime import timedelta
 
+from asgiref.sync import async_to_sync
 from django.core.exceptions import PermissionDenied
+from django.db import connection
 from django.http import HttpRequest, HttpResponse
+from django.template import Context, Template
 from django.contrib.auth.models import AnonymousUser, User
-from django.test import TestCase, RequestFactory
+from django.test import TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
 from spaces.models import Space
-#from .models import Collab
-from .util import is_manager
+from .actions import ActionQueue
+from .activity import LastActivityBuffer
+from .backends import CollabModelBackend
+from .benchmarks import Benchmark
+from .context_processors import default, reset_space_plugins
+from .feed import space_actions
+from .index import space_admin_ids
+from .instrumentation import collect_metrics, permission_checked
+from .models import Collab, SpaceRole
+from .roles import add_managers, rebuild_roles
+from .permissions import FilesPermissions
+from .presence import CachePresenceBackend
+from .provisioning import bulk_create_users, create_missing_collabs, \
+    defer_collab_creation
+from .resolver import get_resolver, prime_roles
+from .shortcuts import annotate_permissions, get_objects_for_user, \
+    iter_objects_for_user
+from .snapshot import SESSION_KEY, compute_snapshot, get_version
+from .util import clear_introspection_cache, db_columns_exist, \
+    db_table_column_exists, db_table_exists, get_collab, is_manager, \
+    is_space_admin, space_admin_exists
 from .decorators import manager_required, permission_required_or_403, space_admin_required
+from .views import files_auth_request, space_feed
 
 
 class TestCollabExtension(TestCase):
@@ -231,4 +260,883 @@ class SpaceAdminRequired(TestCase):
         # manager should be let through
         view.assert_called_once_with(request, *request_args, **request_kwargs)
         self.assertEqual(response, "view called")
-        
\ No newline at end of file
+
+
+class TestLastActivity(TestCase):
+    """
+    test Collab.update_last_activity and the write-behind LastActivityBuffer.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@…', password='top_secret')
+        self.long_ago = timezone.now() - timedelta(days=1)
+        Collab.objects.filter(user=self.user).update(last_activity=self.long_ago)
+        self.collab = Collab.objects.get(user=self.user)
+
+    def stored_last_activity(self):
+        return Collab.objects.get(pk=self.collab.pk).last_activity
+
+    def test_update_is_throttled(self):
+        self.collab.update_last_activity()
+        first = self.stored_last_activity()
+        self.assertGreater(first, self.long_ago)
+        with self.assertNumQueries(0):
+            self.collab.update_last_activity()
+
+    def test_buffer_defers_write_until_flush(self):
+        buffer = LastActivityBuffer(flush_interval=3600, batch_size=100)
+        buffer.touch(self.collab)
+        self.assertEqual(len(buffer), 1)
+        self.assertEqual(self.stored_last_activity(), self.long_ago)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(self.stored_last_activity(), self.collab.last_activity)
+
+    def test_buffer_flushes_when_batch_is_full(self):
+        buffer = LastActivityBuffer(flush_interval=3600, batch_size=1)
+        buffer.touch(self.collab)
+        self.assertEqual(len(buffer), 0)
+        self.assertGreater(self.stored_last_activity(), self.long_ago)
+
+
+class TestPermissionResolver(TestCase):
+    """
+    test that the request-scoped resolver only asks the database once per fact.
+    """
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@…', password='top_secret')
+        self.space = Space.objects.create(name="My new Space", created_by=self.user)
+        self.space.get_admins().user_set.add(self.user)
+        self.request = self.factory.get('/')
+        self.request.user = User.objects.get(pk=self.user.pk)
+        self.request.SPACE = self.space
+
+    def test_resolver_is_attached_to_request(self):
+        resolver = get_resolver(self.request)
+        self.assertIs(self.request.collab_perms, resolver)
+        self.assertIs(get_resolver(self.request), resolver)
+
+    def test_space_admin_is_memoized(self):
+        resolver = get_resolver(self.request)
+        self.assertIs(resolver.is_space_admin(self.space), True)
+        with self.assertNumQueries(0):
+            self.assertIs(resolver.is_space_admin(self.space), True)
+
+    def test_has_perm_is_memoized(self):
+        resolver = get_resolver(self.request)
+        resolver.has_perm('access_space', self.space)
+        with self.assertNumQueries(0):
+            resolver.has_perm('access_space', self.space)
+
+
+@override_settings(
+    CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+    }},
+    COLLAB_ADMIN_INDEX_CACHE='default'
+)
+class TestAdminIndex(TestCase):
+    """
+    test the cached space admin index and its signal based invalidation.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@…', password='top_secret')
+        self.space = Space.objects.create(name="My new Space", created_by=self.user)
+
+    def test_admin_check_is_served_from_cache(self):
+        self.assertIs(is_space_admin(self.user, self.space), False)
+        with self.assertNumQueries(0):
+            self.assertIs(is_space_admin(self.user, self.space), False)
+
+    def test_group_change_invalidates_index(self):
+        self.assertNotIn(self.user.pk, space_admin_ids(self.space))
+        self.space.get_admins().user_set.add(self.user)
+        self.assertIn(self.user.pk, space_admin_ids(self.space))
+        self.user.groups.clear()
+        self.assertNotIn(self.user.pk, space_admin_ids(self.space))
+
+
+class TestSpaceAdminQueries(TestCase):
+    """
+    admin checks must cost the same number of queries regardless of the size
+    of the admin group.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@…', password='top_secret')
+        self.space = Space.objects.create(name="My new Space", created_by=self.user)
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            is_space_admin(self.user, self.space)
+        return len(context.captured_queries)
+
+    def test_query_count_is_independent_of_group_size(self):
+        small = self.count_queries()
+        admins = self.space.get_admins()
+        for i in range(20):
+            admins.user_set.add(User.objects.create_user(username='admin%s' % i))
+        self.assertEqual(self.count_queries(), small)
+
+    def test_space_admin_exists_annotation(self):
+        self.space.get_admins().user_set.add(self.user)
+        other = User.objects.create_user(username='other')
+        flags = dict(User.objects.annotate(
+            is_admin=space_admin_exists(self.space)
+        ).values_list('pk', 'is_admin'))
+        self.assertIs(flags[self.user.pk], True)
+        self.assertIs(flags[other.pk], False)
+
+
+class TestAnnotatePermissions(TestCase):
+    """
+    test the bulk permission annotations of shortcuts.annotate_permissions.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@…', password='top_secret')
+        another_user = User.objects.create_user(username="a", email="a@...", password="a")
+        self.space = Space.objects.create(name="My new Space", created_by=self.user)
+        self.user.groups.add(self.space.get_members())
+        self.another_space = Space.objects.create(name="My second new Space", created_by=another_user)
+        self.another_space.get_admins().user_set.add(self.user)
+
+    def annotated(self):
+        spaces = annotate_permissions(
+            self.user, Space.objects.all(), with_admin=True
+        )
+        return dict(
+            (space.pk, (space.can_access_space, space.is_admin))
+            for space in spaces
+        )
+
+    def test_annotations_for_user(self):
+        result = self.annotated()
+        self.assertEqual(result[self.space.pk], (True, False))
+        self.assertIs(result[self.another_space.pk][1], True)
+
+    def test_annotations_for_manager(self):
+        self.user.collab.is_manager = True
+        result = self.annotated()
+        self.assertEqual(result[self.space.pk], (True, True))
+        self.assertEqual(result[self.another_space.pk], (True, True))
+
+    def test_one_query(self):
+        for i in range(5):
+            space = Space.objects.create(name="Space %s" % i, created_by=self.user)
+            space.get_admins().user_set.add(self.user)
+        self.annotated()
+        with self.assertNumQueries(1):
+            result = self.annotated()
+        self.assertEqual(len(result), 7)
+        self.assertEqual(sum(1 for access, admin in result.values() if admin), 6)
+
+
+class TestIterObjectsForUser(TestCase):
+    """
+    test the streaming variant of get_objects_for_user.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@…', password='top_secret')
+        another_user = User.objects.create_user(username="a", email="a@...", password="a")
+        self.space = Space.objects.create(name="My new Space", created_by=self.user)
+        self.user.groups.add(self.space.get_members())
+        self.another_space = Space.objects.create(name="My second new Space", created_by=another_user)
+
+    def test_same_objects_as_get_objects_for_user(self):
+        expected = set(get_objects_for_user(self.user, 'access_space', Space))
+        self.assertIn(self.space, expected)
+        self.assertNotIn(self.another_space, expected)
+        self.assertEqual(
+            set(iter_objects_for_user(self.user, 'access_space', Space, chunk_size=1)),
+            expected
+        )
+
+    def test_ids_for_manager(self):
+        self.user.collab.is_manager = True
+        self.assertEqual(
+            set(iter_objects_for_user(self.user, 'access_space', Space, ids_only=True)),
+            set(Space.objects.values_list('pk', flat=True))
+        )
+
+
+class TestCollabModelBackend(TestCase):
+    """
+    the backend loads the Collab extension in the same query as the user.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@…', password='top_secret')
+
+    def test_collab_is_loaded_with_user(self):
+        with self.assertNumQueries(1):
+            user = CollabModelBackend().get_user(self.user.pk)
+            self.assertIs(is_manager(user), False)
+
+    def test_user_without_collab(self):
+        Collab.objects.filter(user=self.user).delete()
+        with self.assertNumQueries(1):
+            user = CollabModelBackend().get_user(self.user.pk)
+            self.assertIs(is_manager(user), False)
+
+
+class TestMissingCollabs(TestCase):
+    """
+    users created before collab got installed lack the Collab extension.
+    """
+    def setUp(self):
+        for i in range(5):
+            User.objects.create_user(username='user%s' % i)
+        Collab.objects.all().delete()
+
+    def test_create_missing_collabs(self):
+        self.assertEqual(create_missing_collabs(batch_size=2), 5)
+        self.assertEqual(Collab.objects.count(), 5)
+        self.assertEqual(create_missing_collabs(), 0)
+
+    def test_get_collab_without_auto_creation(self):
+        user = User.objects.get(username='user0')
+        self.assertIsNone(get_collab(user))
+
+    @override_settings(COLLAB_CREATE_MISSING=True)
+    def test_get_collab_with_auto_creation(self):
+        user = User.objects.get(username='user0')
+        self.assertIsNotNone(get_collab(user))
+        self.assertEqual(Collab.objects.filter(user=user).count(), 1)
+
+
+class TestBulkProvisioning(TestCase):
+    """
+    test creating many users and their Collab extensions in bulk.
+    """
+    def test_defer_collab_creation(self):
+        with defer_collab_creation():
+            for i in range(3):
+                User.objects.create_user(username='user%s' % i)
+            self.assertEqual(Collab.objects.count(), 0)
+        self.assertEqual(Collab.objects.count(), 3)
+
+    def test_bulk_create_users(self):
+        users = bulk_create_users(
+            [User(username='user%s' % i) for i in range(3)],
+            is_manager=True
+        )
+        self.assertTrue(all(user.pk for user in users))
+        self.assertEqual(
+            Collab.objects.filter(is_manager=True, user__in=users).count(), 3
+        )
+
+
+class TestContextProcessor(TestCase):
+    """
+    the space plugins are computed once and served as a tuple.
+    """
+    def setUp(self):
+        reset_space_plugins()
+        self.addCleanup(reset_space_plugins)
+        self.request = RequestFactory().get('/')
+
+    def test_space_plugins_are_cached(self):
+        with mock.patch('collab.context_processors.SpacePluginRegistry') as registry:
+            registry.get_plugins.return_value = iter(['plugin'])
+            first = default(self.request)["space_plugins"]
+            second = default(self.request)["space_plugins"]
+        self.assertEqual(first, ('plugin',))
+        self.assertIs(first, second)
+        self.assertEqual(registry.get_plugins.call_count, 1)
+
+
+class TestActionQueue(TestCase):
+    """
+    test batching of deferred activity stream actions.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@…', password='top_secret')
+        self.space = Space.objects.create(name="My new Space", created_by=self.user)
+
+    def test_actions_are_written_in_one_batch(self):
+        from actstream.models import Action
+        queue = ActionQueue()
+        before = Action.objects.count()
+        with mock.patch.object(queue, 'schedule_flush') as schedule_flush:
+            queue.add(queue.build_action(self.space, "was updated"))
+            queue.add(queue.build_action(self.space, "was updated"))
+        schedule_flush.assert_called_once_with()
+        with self.assertNumQueries(1):
+            self.assertEqual(queue.flush(), 2)
+        self.assertEqual(Action.objects.count(), before + 2)
+
+    def test_failed_flush_is_logged(self):
+        from actstream.models import Action
+        queue = ActionQueue()
+        queue._pending.append(queue.build_action(self.space, "was updated"))
+        with mock.patch.object(Action.objects, 'bulk_create', side_effect=ValueError), \
+                mock.patch('collab.actions.connections'), \
+                self.assertLogs('collab.actions', 'ERROR'):
+            queue._flush_in_thread()
+
+
+class TestSchemaIntrospection(TestCase):
+    """
+    test the cached db_table_exists / db_table_column_exists helpers.
+    """
+    def setUp(self):
+        clear_introspection_cache()
+        self.table = Collab._meta.db_table
+
+    def test_table_and_columns(self):
+        self.assertIs(db_table_exists(self.table), True)
+        self.assertIs(db_table_exists('no_such_table'), False)
+        self.assertIs(db_table_column_exists(self.table, 'last_activity'), True)
+        self.assertIs(db_table_column_exists(self.table, 'no_such_column'), False)
+        self.assertIs(db_table_column_exists('no_such_table', 'id'), False)
+
+    def test_introspection_is_cached(self):
+        db_table_column_exists(self.table, 'is_manager')
+        with self.assertNumQueries(0):
+            result = db_columns_exist([
+                (self.table, 'is_manager'),
+                (self.table, None),
+                ('no_such_table', None),
+            ])
+        self.assertEqual(list(result.values()), [True, True, False])
+
+
+class TestBenchmark(TestCase):
+    """
+    smoke test for the benchmark suite.
+    """
+    def test_benchmark_runs_and_rolls_back(self):
+        users_before = User.objects.count()
+        results = Benchmark(users=5, spaces=2, admins=2, iterations=2).run()
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(result.calls == 2 for result in results))
+        self.assertEqual(User.objects.count(), users_before)
+
+
+@override_settings(COLLAB_PERMISSION_METRICS=True)
+class TestInstrumentation(TestCase):
+    """
+    instrumented checks send permission_checked and are aggregated per request.
+    """
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@…', password='top_secret')
+        self.space = Space.objects.create(name="My new Space", created_by=self.user)
+        self.receiver = mock.MagicMock()
+        permission_checked.connect(self.receiver)
+        self.addCleanup(permission_checked.disconnect, self.receiver)
+
+    def test_util_check_sends_signal(self):
+        is_space_admin(self.user, self.space)
+        kwargs = self.receiver.call_args[1]
+        self.assertEqual(kwargs['check'], 'is_space_admin')
+        self.assertIs(kwargs['allowed'], False)
+        self.assertGreaterEqual(kwargs['queries'], 1)
+
+    def test_nested_checks_are_aggregated_once(self):
+        request = self.factory.get('/')
+        request.user = self.user
+        request.SPACE = self.space
+        view = space_admin_required(mock.MagicMock())
+        with collect_metrics() as metrics:
+            self.assertRaises(PermissionDenied, view, request)
+        self.assertEqual(metrics.checks, 1)
+        self.assertEqual(metrics.denied, 1)
+        self.assertIn('space_admin_required', metrics.by_check)
+        self.assertGreater(self.receiver.call_count, 1)
+
+
+class TestPrimeRoles(TestCase):
+    """
+    roles of a whole member list are computed with a constant number of
+    queries and reused by the template filters.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@…', password='top_secret')
+        self.space = Space.objects.create(name="My new Space", created_by=self.user)
+        for i in range(5):
+            User.objects.create_user(username='user%s' % i)
+        self.space.get_admins().user_set.add(self.user)
+
+    def test_filters_use_precomputed_roles(self):
+        from .templatetags.collab_tags import is_admin_or_manager, is_manager as is_manager_filter
+        users = list(User.objects.all())
+        roles = prime_roles(users, self.space)
+        self.assertIs(roles[self.user.pk]['is_admin'], True)
+        with self.assertNumQueries(0):
+            for user in users:
+                is_manager_filter(user)
+                self.assertEqual(
+                    is_admin_or_manager(user, self.space),
+                    user.pk == self.user.pk
+                )
+
+
+class TestActionUrl(TestCase):
+    """
+    test the action_url template tag.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@…', password='top_secret')
+        self.space = Space.objects.create(name="My new Space", created_by=self.user)
+
+    def render(self, template, **context):
+        return Template("{% load collab_tags %}" + template).render(Context(context))
+
+    def test_space_url(self):
+        self.assertEqual(
+            self.render("{% action_url obj %}", obj=self.space),
+            '/%s/' % self.space.slug
+        )
+
+    def test_asvar_and_missing_object(self):
+        self.assertEqual(
+            self.render("{% action_url obj as url %}[{{ url }}]", obj=self.space),
+            '[/%s/]' % self.space.slug
+        )
+        self.assertEqual(self.render("{% action_url missing %}"), '')
+
+    def test_url_is_built_once_per_render(self):
+        builder = mock.MagicMock(return_value='/x/')
+        with mock.patch.dict('collab.util._action_url_builders', {Space: builder}):
+            self.render("{% action_url obj %}{% action_url obj %}", obj=self.space)
+        builder.assert_called_once_with(self.space)
+
+
+class TestAsyncDecorators(TestCase):
+    """
+    the decorators wrap coroutine views in async views.
+    """
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@…', password='top_secret')
+        self.space = Space.objects.create(name="My new Space", created_by=self.user)
+        self.user.groups.add(self.space.get_members())
+        self.request = self.factory.get('/')
+        self.request.user = self.user
+        self.request.SPACE = self.space
+
+    async def view(self, request):
+        return HttpResponse("ok")
+
+    def test_permission_required(self):
+        decorated = permission_required_or_403('access_space')(self.view)
+        self.assertTrue(asyncio.iscoroutinefunction(decorated))
+        response = async_to_sync(decorated)(self.request)
+        self.assertEqual(response.status_code, 200)
+
+    def test_manager_required(self):
+        decorated = manager_required(self.view)
+        self.assertTrue(asyncio.iscoroutinefunction(decorated))
+        response = async_to_sync(decorated)(self.request)
+        self.assertEqual(response.status_code, 302)
+        self.user.collab.is_manager = True
+        response = async_to_sync(decorated)(self.request)
+        self.assertEqual(response.status_code, 200)
+
+    def test_space_admin_required(self):
+        decorated = space_admin_required(self.view)
+        self.assertRaises(PermissionDenied, async_to_sync(decorated), self.request)
+
+
+@override_settings(COLLAB_ROLE_TABLE=True)
+class TestRoleTable(TestCase):
+    """
+    test the signal maintained SpaceRole table.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@…', password='top_secret')
+        self.space = Space.objects.create(name="My new Space", created_by=self.user)
+
+    def is_admin_role(self):
+        return SpaceRole.objects.filter(
+            user=self.user, space=self.space, role=SpaceRole.ADMIN
+        ).exists()
+
+    def test_group_membership_is_tracked(self):
+        self.assertIs(self.is_admin_role(), False)
+        self.space.get_admins().user_set.add(self.user)
+        self.assertIs(self.is_admin_role(), True)
+        self.assertIs(is_space_admin(self.user, self.space), True)
+        self.user.groups.remove(self.space.get_admins())
+        self.assertIs(self.is_admin_role(), False)
+        self.assertIs(is_space_admin(self.user, self.space), False)
+
+    def test_manager_is_tracked(self):
+        self.user.collab.is_manager = True
+        self.user.collab.save()
+        add_managers([self.user.pk])
+        self.assertEqual(SpaceRole.objects.filter(
+            user=self.user, role=SpaceRole.MANAGER
+        ).count(), 1)
+        # the role is read from the table
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(1):
+            self.assertIs(is_manager(user), True)
+        self.assertIn(self.space, get_objects_for_user(user, 'access_space', Space))
+
+    def test_last_activity_does_not_sync(self):
+        collab = Collab.objects.get(user=self.user)
+        collab.last_activity = timezone.now() - timedelta(days=1)
+        with self.assertNumQueries(1):
+            collab.update_last_activity()
+
+    def test_rebuild(self):
+        self.space.get_admins().user_set.add(self.user)
+        SpaceRole.objects.all().delete()
+        rebuild_roles()
+        self.assertIs(self.is_admin_role(), True)
+
+
+class TestCollabQuerySet(TestCase):
+    """
+    test the last_activity based queries.
+    """
+    def setUp(self):
+        now = timezone.now()
+        for i in range(5):
+            user = User.objects.create_user(username='user%s' % i)
+            Collab.objects.filter(user=user).update(
+                last_activity=now - timedelta(days=i)
+            )
+        self.now = now
+
+    def test_recent_and_inactive(self):
+        self.assertEqual(Collab.objects.recently_active(minutes=60).count(), 1)
+        self.assertEqual(
+            Collab.objects.inactive_since(self.now - timedelta(hours=36)).count(), 3
+        )
+
+    def test_iter_keyset(self):
+        collabs = list(Collab.objects.iter_keyset(chunk_size=2))
+        self.assertEqual(len(collabs), 5)
+        self.assertEqual(
+            [c.last_activity for c in collabs],
+            sorted(c.last_activity for c in collabs)
+        )
+        newest_first = list(Collab.objects.iter_keyset(chunk_size=2, descending=True))
+        self.assertEqual(newest_first, collabs[::-1])
+
+    def test_in_space(self):
+        user = User.objects.get(username='user0')
+        space = Space.objects.create(name="My new Space", created_by=user)
+        user.groups.add(space.get_members())
+        self.assertEqual(
+            list(Collab.objects.in_space(space).recently_active(60)),
+            [user.collab]
+        )
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+}})
+class TestCachePresenceBackend(TestCase):
+    """
+    test the cache based presence backend.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@…', password='top_secret')
+        self.other = User.objects.create_user(username='other')
+        self.backend = CachePresenceBackend()
+
+    def test_online_users(self):
+        self.backend.touch(self.user)
+        self.assertEqual(
+            self.backend.online_user_pks([self.user.pk, self.other.pk]),
+            set([self.user.pk])
+        )
+        self.assertIsNotNone(self.backend.last_seen(self.user.pk))
+
+    def test_touch_causes_no_queries(self):
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            self.backend.touch(user)
+            self.backend.touch(user)
+        self.assertEqual(len(self.backend.buffer), 1)
+        self.assertEqual(self.backend.buffer.flush(), 1)
+        self.assertLessEqual(
+            Collab.objects.get(user=self.user).last_activity,
+            self.backend.last_seen(self.user.pk)
+        )
+
+
+def deny_everything(request, perm, obj):
+    return False
+
+
+class TestShortCircuitRules(TestCase):
+    """
+    permission_required evaluates cheap rules before asking guardian.
+    """
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@…', password='top_secret')
+        self.space = Space.objects.create(name="My new Space", created_by=self.user)
+        self.user.groups.add(self.space.get_members())
+        self.view = permission_required_or_403('access_space')(
+            lambda request: HttpResponse("ok")
+        )
+
+    def get_request(self, user):
+        request = self.factory.get('/')
+        request.user = user
+        request.SPACE = self.space
+        return request
+
+    def test_anonymous_user_is_redirected_without_queries(self):
+        request = self.get_request(AnonymousUser())
+        with self.assertNumQueries(0):
+            response = self.view(request)
+        self.assertEqual(response.status_code, 302)
+
+    def test_superuser_is_granted_without_queries(self):
+        self.user.is_superuser = True
+        request = self.get_request(self.user)
+        with self.assertNumQueries(0):
+            response = self.view(request)
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(COLLAB_PERMISSION_SHORT_CIRCUITS=[
+        'collab.tests.deny_everything'
+    ])
+    def test_custom_rule(self):
+        response = self.view(self.get_request(self.user))
+        self.assertEqual(response.status_code, 403)
+
+
+class TestFilesPermissions(TestCase):
+    """
+    test read permissions for files.
+    """
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@…', password='top_secret')
+        self.space = Space.objects.create(name="My new Space", created_by=self.user)
+        another_user = User.objects.create_user(username="a")
+        self.another_space = Space.objects.create(name="My second new Space", created_by=another_user)
+        self.user.groups.add(self.space.get_members())
+        self.paths = ['files/%s.png' % i for i in range(10)]
+
+    def get_request(self, user, space):
+        request = self.factory.get('/')
+        request.user = user
+        request.SPACE = space
+        return request
+
+    def test_filter_readable(self):
+        files = FilesPermissions()
+        request = self.get_request(self.user, self.space)
+        self.assertEqual(files.filter_readable(request, self.paths), self.paths)
+        request = self.get_request(self.user, self.another_space)
+        self.assertEqual(files.filter_readable(request, self.paths), [])
+        request = self.get_request(AnonymousUser(), self.space)
+        self.assertEqual(files.filter_readable(request, self.paths), [])
+
+    def test_one_decision_per_prefix(self):
+        files = FilesPermissions()
+        request = self.get_request(self.user, self.space)
+        with mock.patch.object(files, 'has_path_permission', return_value=True) as check:
+            files.filter_readable(request, self.paths)
+        self.assertEqual(check.call_count, 1)
+        with mock.patch.object(files, 'get_cache_prefix', side_effect=lambda path: path):
+            with mock.patch.object(files, 'has_path_permission', return_value=True) as check:
+                files.filter_readable(request, self.paths)
+        self.assertEqual(check.call_count, len(self.paths))
+
+
+class TestFilesAuthRequest(TestCase):
+    """
+    test the auth_request endpoint for protected files.
+    """
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@…', password='top_secret')
+        self.space = Space.objects.create(name="My new Space", created_by=self.user)
+        self.user.groups.add(self.space.get_members())
+        another_user = User.objects.create_user(username="a")
+        self.another_space = Space.objects.create(name="My second new Space", created_by=another_user)
+
+    def get_path(self, space):
+        return '/media/protected/%s/a%%20b.png' % space.slug
+
+    def get_request(self, user, **cookies):
+        request = self.factory.get('/', HTTP_X_ORIGINAL_URI=self.get_path(self.space))
+        request.user = user
+        request.COOKIES.update(cookies)
+        return request
+
+    def test_member_gets_token(self):
+        response = files_auth_request(self.get_request(self.user))
+        self.assertEqual(response.status_code, 200)
+        token = response.cookies['collab_files'].value
+        # the token grants access without looking at the user
+        request = self.get_request(AnonymousUser(), collab_files=token)
+        with self.assertNumQueries(0):
+            response = files_auth_request(request)
+        self.assertEqual(response.status_code, 200)
+
+    def test_denied(self):
+        response = files_auth_request(self.get_request(AnonymousUser()))
+        self.assertEqual(response.status_code, 403)
+        response = files_auth_request(
+            self.get_request(AnonymousUser(), collab_files='forged')
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_space_is_taken_from_the_path(self):
+        self.client.force_login(self.user)
+        url = reverse('collab:files_auth_request')
+        response = self.client.get(url, HTTP_X_ORIGINAL_URI=self.get_path(self.space))
+        self.assertEqual(response.status_code, 200)
+        # the token is bound to the space of the path
+        for path in (self.get_path(self.another_space), '/media/protected/a.png',
+                '/media/avatars/a.png'):
+            response = self.client.get(url, HTTP_X_ORIGINAL_URI=path)
+            self.assertEqual(response.status_code, 403)
+
+    def test_path_traversal_is_denied(self):
+        self.client.force_login(self.user)
+        url = reverse('collab:files_auth_request')
+        for template in ('/media/protected/%s/../%s/secret.pdf',
+                '/media/protected/%s/%%2e%%2e/%s/secret.pdf',
+                '/media/protected/%s//../%s/secret.pdf'):
+            path = template % (self.space.slug, self.another_space.slug)
+            response = self.client.get(url, HTTP_X_ORIGINAL_URI=path)
+            self.assertEqual(response.status_code, 403)
+            self.assertNotIn('collab_files', response.cookies)
+
+
+@override_settings(COLLAB_ROLE_SNAPSHOT=True)
+class TestRoleSnapshot(TestCase):
+    """
+    test the session role snapshot.
+    """
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@…', password='top_secret')
+        self.space = Space.objects.create(name="My new Space", created_by=self.user)
+        another_user = User.objects.create_user(username="a")
+        self.another_space = Space.objects.create(name="My second new Space", created_by=another_user)
+        self.user.groups.add(self.space.get_members(), self.space.get_admins())
+
+    def get_request(self):
+        self.client.force_login(self.user)
+        request = self.factory.get('/')
+        request.user = User.objects.get(pk=self.user.pk)
+        request.session = self.client.session
+        self.assertIn(SESSION_KEY, request.session)
+        return request
+
+    def test_checks_read_the_snapshot(self):
+        request = self.get_request()
+        with self.assertNumQueries(0):
+            resolver = get_resolver(request)
+            self.assertFalse(resolver.is_manager)
+            self.assertTrue(resolver.is_space_admin(self.space))
+            self.assertFalse(resolver.is_space_admin(self.another_space))
+            self.assertTrue(resolver.has_perm('access_space', self.space))
+            self.assertFalse(resolver.has_perm('access_space', self.another_space))
+
+    def test_changes_invalidate_the_snapshot(self):
+        request = self.get_request()
+        self.user.groups.add(self.another_space.get_members())
+        collab = self.user.collab
+        collab.is_manager = True
+        collab.save()
+        resolver = get_resolver(request)
+        self.assertTrue(resolver.is_manager)
+        self.assertTrue(resolver.has_perm('access_space', self.another_space))
+
+    def test_last_activity_keeps_the_version(self):
+        version = get_version(self.user.pk)
+        Collab.objects.filter(user=self.user).update(
+            last_activity=timezone.now() - timedelta(days=1))
+        collab = Collab.objects.get(user=self.user)
+        collab.update_last_activity()
+        self.assertEqual(get_version(self.user.pk), version)
+        collab.save()
+        self.assertNotEqual(get_version(self.user.pk), version)
+
+    def test_queries_do_not_grow_with_spaces(self):
+        def count():
+            with CaptureQueriesContext(connection) as queries:
+                compute_snapshot(User.objects.get(pk=self.user.pk))
+            return len(queries)
+        expected = count()
+        for i in range(5):
+            space = Space.objects.create(name="Space %s" % i, created_by=self.user)
+            space.get_admins().user_set.add(self.user)
+        self.assertEqual(count(), expected)
+        self.assertEqual(
+            len(compute_snapshot(self.user).admin_space_pks), 6
+        )
+
+
+class TestSpaceFeed(TestCase):
+    """
+    test the keyset-paginated space feed.
+    """
+    def setUp(self):
+        from actstream.models import Action
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@…', password='top_secret')
+        self.space = Space.objects.create(name="My new Space", created_by=self.user)
+        another_space = Space.objects.create(name="My second new Space", created_by=self.user)
+        self.user.groups.add(self.space.get_members())
+        now = timezone.now()
+        # equal timestamps are ordered by id
+        self.pks = [
+            Action.objects.create(actor=self.user, verb='posted',
+                target=self.space, timestamp=now - timedelta(minutes=i // 2)).pk
+            for i in range(5)
+        ]
+        Action.objects.create(actor=self.user, verb='posted', target=another_space)
+
+    def test_pages(self):
+        seen, cursor = [], None
+        while True:
+            page = space_actions(self.space, cursor=cursor, limit=2)
+            self.assertLessEqual(len(page.actions), 2)
+            seen.extend(action.pk for action in page.actions)
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        pks = self.pks
+        self.assertEqual(seen, [pks[1], pks[0], pks[3], pks[2], pks[4]])
+
+    def test_actors_are_prefetched(self):
+        page = space_actions(self.space)
+        with self.assertNumQueries(0):
+            for action in page.actions:
+                self.assertEqual(action.actor, self.user)
+                self.assertEqual(action.target, self.space)
+
+    def test_view(self):
+        request = self.factory.get('/')
+        request.user = self.user
+        request.SPACE = self.space
+        response = space_feed(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)['actions']), 5)
+        for cursor in ('nonsense', '99999999999999999999-1',
+                '0-99999999999999999999'):
+            request = self.factory.get('/', {'cursor': cursor})
+            request.user = self.user
+            request.SPACE = self.space
+            self.assertEqual(space_feed(request).status_code, 400)
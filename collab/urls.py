@@ -5,4 +5,6 @@ app_name = "collab"
 urlpatterns = [
     url(r'^$', views.index, name="index"),
     url(r'^empty_iframe/$', views.EmptyIframe.as_view(), name='empty_iframe'),
+    url(r'^files/auth/$', views.files_auth_request, name='files_auth_request'),
+    url(r'^feed/$', views.space_feed, name='space_feed'),
 ]
\ No newline at end of file
@@ -1,50 +1,228 @@
-from django.db import connection
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Exists, OuterRef
 
+from .index import get_index_cache, space_admin_ids, space_admin_ids_many
+from .instrumentation import instrument
+from .models import Collab, SpaceGroup, SpaceRole
+from .roles import role_table_enabled
+
+def get_collab(user):
+    """
+    Returns the Collab extension of the given user or None if the user has
+    none, e.g. because they were created before collab got installed.
+
+    With COLLAB_CREATE_MISSING = True, a missing extension is created on
+    access instead.
+    """
+    collab = getattr(user, 'collab', None)
+    if collab is None and user is not None and user.pk is not None and \
+        getattr(settings, "COLLAB_CREATE_MISSING", False):
+        collab, created = Collab.objects.get_or_create(user=user)
+        user.collab = collab
+    return collab
+
+def has_manager_role(user):
+    """
+    Returns Collab.is_manager of the given user. With COLLAB_ROLE_TABLE set,
+    the manager row of SpaceRole is looked up instead, unless the Collab is
+    already loaded with the user.
+    """
+    if user is None or user.pk is None:
+        return False
+    if role_table_enabled() and \
+        not Collab._meta.get_field('user').remote_field.is_cached(user):
+        return SpaceRole.objects.filter(
+            user_id=user.pk, role=SpaceRole.MANAGER, space__isnull=True
+        ).exists()
+    return getattr(get_collab(user), 'is_manager', False)
+
+def _get_snapshot(user):
+    """
+    Returns the role snapshot loaded for user by a request, if any.
+    """
+    resolver = getattr(user, '_collab_perms', None)
+    return resolver.snapshot if resolver is not None else None
+
+@instrument('is_manager')
 def is_manager(user):
     """
     Returns True if user has at least management rights, else False.
     """
     if user and user.is_authenticated:
-        if user.collab.is_manager or user.is_superuser:
+        snapshot = _get_snapshot(user)
+        if snapshot is not None:
+            return snapshot.is_manager or user.is_superuser
+        if user.is_superuser or has_manager_role(user):
             return True
     return False
 
+@instrument('is_space_admin')
+def is_space_admin(user, space):
+    """
+    Returns True if the user is a member of the admin group of the given space.
+    Uses the cached admin index if COLLAB_ADMIN_INDEX_CACHE is set.
+    """
+    snapshot = _get_snapshot(user)
+    if snapshot is not None:
+        return space.pk in snapshot.admin_space_pks
+    if get_index_cache() is not None:
+        return user.pk in space_admin_ids(space)
+    if user.pk is None:
+        return False
+    if role_table_enabled():
+        return SpaceRole.objects.filter(
+            user_id=user.pk, space_id=space.pk, role=SpaceRole.ADMIN
+        ).exists()
+    return space.get_admins().user_set.filter(pk=user.pk).exists()
+
+def admin_space_pks(user, spaces):
+    """
+    Returns the set of pks of those of the given spaces the user is an admin
+    of.
+    """
+    if user.pk is None:
+        return set()
+    if get_index_cache() is not None:
+        return set(
+            space_pk for space_pk, admin_ids
+            in space_admin_ids_many(spaces).items() if user.pk in admin_ids
+        )
+    return set(administered_space_pks(user).filter(
+        space_id__in=[space.pk for space in spaces]
+    ))
+
+def administered_space_pks(user):
+    """
+    Returns a flat values_list of the pks of all spaces the user is an admin
+    of, from SpaceRole if COLLAB_ROLE_TABLE is set, else from SpaceGroup.
+    """
+    if role_table_enabled():
+        queryset = SpaceRole.objects.filter(
+            user_id=user.pk, role=SpaceRole.ADMIN
+        )
+    else:
+        queryset = SpaceGroup.objects.filter(
+            group__user=user.pk, role=SpaceGroup.ADMIN
+        )
+    return queryset.values_list('space_id', flat=True)
+
+def space_admin_exists(space, user_ref=OuterRef('pk')):
+    """
+    Returns an Exists() expression which is True for users in the admin group
+    of the given space. Useful for annotating user querysets, e.g.:
+
+    User.objects.annotate(is_admin=space_admin_exists(space))
+    """
+    return Exists(space.get_admins().user_set.filter(pk=user_ref))
+
+@instrument('is_owner_or_admin')
 def is_owner_or_admin(user, owner, space):
     """
     Returns True if either the user is the owner, the user is a space admin
     or the user is a manager. returns False otherwise.
     """
     is_owner = user == owner
-    is_admin = user in space.get_admins().user_set.all()
-    is_manager = hasattr(user, 'collab') and user.collab.is_manager
+    is_admin = is_space_admin(user, space)
+    is_manager = has_manager_role(user)
     return is_owner or is_admin or is_manager
 
+@instrument('is_space_admin_or_manager')
 def is_space_admin_or_manager(user, space):
     """
     Returns True if either the user is the owner, the user is a space admin
     or the user is a manager. returns False otherwise.
     """
-    is_admin = user in space.get_admins().user_set.all()
-    is_manager = hasattr(user, 'collab') and user.collab.is_manager
+    is_admin = is_space_admin(user, space)
+    is_manager = has_manager_role(user)
     return is_admin or is_manager
 
-def db_table_exists(table_name):
+_action_url_builders = {}
+
+def register_action_url(model, builder):
+    """
+    Register a callable returning the URL of an instance of model, used by
+    the action_url template tag for actstream actors, objects and targets.
+    Subclasses of model use the same builder.
+    """
+    _action_url_builders[model] = builder
+
+def get_action_url(obj):
+    """
+    Returns the URL of the given actstream actor, object or target: from the
+    builder registered for its class, else from get_absolute_url(), else ''.
+    """
+    for klass in type(obj).__mro__:
+        builder = _action_url_builders.get(klass)
+        if builder is not None:
+            return builder(obj)
+    get_absolute_url = getattr(obj, 'get_absolute_url', None)
+    return get_absolute_url() if get_absolute_url is not None else ''
+
+# per connection alias: {'tables': set of table names,
+#                        'columns': {table name: set of column names}}
+_introspection_cache = {}
+
+def _get_schema(using):
+    schema = _introspection_cache.get(using)
+    if schema is None:
+        connection = connections[using]
+        with connection.cursor() as cursor:
+            tables = frozenset(connection.introspection.table_names(cursor))
+        schema = _introspection_cache[using] = {'tables': tables, 'columns': {}}
+    return schema
+
+def _get_columns(schema, table_name, using):
+    columns = schema['columns'].get(table_name)
+    if columns is None:
+        connection = connections[using]
+        with connection.cursor() as cursor:
+            columns = frozenset(
+                f.name for f in
+                connection.introspection.get_table_description(cursor, table_name)
+            )
+        schema['columns'][table_name] = columns
+    return columns
+
+def clear_introspection_cache(using=None, **kwargs):
+    """
+    Forget the cached schema of the given connection alias or of all
+    connections. Called on post_migrate.
+    """
+    if using is None:
+        _introspection_cache.clear()
+    else:
+        _introspection_cache.pop(using, None)
+
+def db_columns_exist(pairs, using=DEFAULT_DB_ALIAS):
+    """
+    Checks a batch of (table_name, column_name) pairs at once. column_name may
+    be None to only check the table. Returns a dict mapping each pair to
+    True or False.
+
+    The schema is introspected once per connection alias and cached until the
+    next migration.
+    """
+    schema = _get_schema(using)
+    result = {}
+    for table_name, column_name in pairs:
+        if table_name not in schema['tables']:
+            result[(table_name, column_name)] = False
+        elif column_name is None:
+            result[(table_name, column_name)] = True
+        else:
+            result[(table_name, column_name)] = \
+                column_name in _get_columns(schema, table_name, using)
+    return result
+
+def db_table_exists(table_name, using=DEFAULT_DB_ALIAS):
     """ check whether the given table already exists in the database """
-    cursor = connection.cursor()
-    table_list = connection.introspection.table_names(cursor)
-    return table_name in table_list
+    return table_name in _get_schema(using)['tables']
 
-def db_table_column_exists(table_name, column_name):
+def db_table_column_exists(table_name, column_name, using=DEFAULT_DB_ALIAS):
     """
     check whether the given column already exists for the given table in the database
     """
-    cursor = connection.cursor()
-    table_list = connection.introspection.table_names(cursor)
-    if table_name in table_list:
-        field_list = connection.introspection.get_table_description(cursor,table_name)
-        found = False
-        for f in field_list:
-            if f.name == column_name:
-                found = True
-                break
-    return found
+    return db_columns_exist([(table_name, column_name)], using)[
+        (table_name, column_name)
+    ]
@@ -1,9 +1,17 @@
 # -*- coding: utf-8 -*-
 from django.shortcuts import render, redirect
 import json
-from django.http import HttpResponse
+import posixpath
+from urllib.parse import unquote, urlparse
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
 from django.urls import reverse
 from django.views.generic.base import TemplateView
+from .decorators import permission_required_or_403
+from .feed import space_actions
+from .permissions import check_files_token, get_files_permissions, \
+    sign_files_token
+from .util import get_action_url
 
 # Create your views here.
 
@@ -18,4 +26,70 @@ class EmptyIframe(TemplateView):
         Display a template that apart from a centered spinner is empty. Useful
         as defaut content of an iframe.
     """
-    template_name = "collab/empty_iframe.html"
\ No newline at end of file
+    template_name = "collab/empty_iframe.html"
+
+def files_auth_request(request):
+    """
+        Minimal endpoint for reverse proxies protecting file downloads, e.g.
+        nginx' auth_request. Answers 200 if the user may read the path in
+        the X-Original-URI header, else 403, without rendering anything.
+
+        The space is taken from the path, see FilesPermissions.get_space(),
+        not from the URL of this endpoint. Paths outside of any space and
+        paths which aren't normalized are denied.
+
+        Granted requests set a short-lived signed token cookie. Later
+        requests for paths in the same scope are answered from the token
+        without loading session user or permissions.
+    """
+    files = get_files_permissions()
+    path = unquote(urlparse(request.META.get('HTTP_X_ORIGINAL_URI', '')).path)
+    # the proxy may serve a normalized path from another space than the
+    # one in the raw path, e.g. for /media/protected/a/../b/file
+    if '..' in path.split('/') or posixpath.normpath(path) != path:
+        return HttpResponse(status=403)
+    if files.get_space_slug(path) is None:
+        return HttpResponse(status=403)
+    cookie_name = getattr(settings, "COLLAB_FILES_TOKEN_COOKIE", 'collab_files')
+    token = request.COOKIES.get(cookie_name)
+    if token and check_files_token(request, files, path, token):
+        return HttpResponse(status=200)
+    request.SPACE = files.get_space(request, path)
+    if request.SPACE is None or not files.has_read_permission(request, path):
+        return HttpResponse(status=403)
+    response = HttpResponse(status=200)
+    response.set_cookie(
+        cookie_name,
+        sign_files_token(request, files, path),
+        max_age=getattr(settings, "COLLAB_FILES_TOKEN_MAX_AGE", 300),
+        secure=request.is_secure(),
+        httponly=True,
+    )
+    return response
+
+@permission_required_or_403('access_space')
+def space_feed(request):
+    """
+        JSON page of the current space's activity feed. Pass the returned
+        next_cursor as ?cursor= to get the following page.
+    """
+    try:
+        page = space_actions(request.SPACE, cursor=request.GET.get('cursor'))
+    except ValueError:
+        return HttpResponseBadRequest()
+    return JsonResponse({
+        'actions': [_serialize_action(action) for action in page.actions],
+        'next_cursor': page.next_cursor,
+    })
+
+def _serialize_action(action):
+    actor, action_object = action.actor, action.action_object
+    return {
+        'actor': str(actor) if actor is not None else None,
+        'actor_url': get_action_url(actor) if actor is not None else '',
+        'verb': action.verb,
+        'action_object': str(action_object) if action_object is not None else None,
+        'action_object_url':
+            get_action_url(action_object) if action_object is not None else '',
+        'timestamp': action.timestamp.isoformat(),
+    }